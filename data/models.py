@@ -4,8 +4,8 @@ import enum
 import uuid
 
 from sqlalchemy import (Table, Column, String, Integer, ForeignKey,
-                        Float, Enum, BigInteger)
-from sqlalchemy.orm import relationship
+                        Float, Enum, BigInteger, REAL, Index)
+from sqlalchemy.orm import relationship, selectinload
 from sqlalchemy.sql import exists
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -14,6 +14,10 @@ Base = declarative_base()
 from model_keys import *
 from .types import UUID_ID
 
+ACCELEROMETER_UNITS = 'm/s^2'
+GYROSCOPE_UNITS = 'deg/sec'
+MAGNETOMETER_UNITS = 'microtesla'
+
 def is_uuid4(obj):
     try:
         uuid_obj = uuid.UUID(str(obj), version=4)
@@ -64,6 +68,12 @@ class Session(Base):
     -------
     find_by_athlete(db:sqlalchemy.Session, athlete:uuid4)
         Helper function for finding Sessions with a given athlete
+    find_by_athletes(db:sqlalchemy.Session, athletes:list[uuid4])
+        Helper function for finding Sessions of any of the athletes with
+        one query
+    dictionary_options(events:bool optional, readings:bool optional)
+        Loader options that fetch everything dictionary() serializes up
+        front, one query per relationship instead of one per row
     get_session_sensors(db:sqlalchemy.Session, id:str)
         Helper function for getting a list of sensors used in a given session
     get_session_events(db:sqlalchemy.Session, id:str)
@@ -75,14 +85,16 @@ class Session(Base):
         the session
     get_readings()
         Helper function that returns the list of readings in the session
-    dictionary()
-        Returns Session object in dictionary format 
+    dictionary(db:sqlalchemy.Session, events:bool optional,
+               readings:bool optional)
+        Returns Session object in dictionary format, optionally without
+        its events or its sensors' readings
     """
     __tablename__ = 'session'
 
     id = Column('id', UUID_ID(), default=uuid.uuid4, nullable=False,
                 unique=True, primary_key=True)
-    athlete = Column('athlete', UUID_ID(), nullable=False)
+    athlete = Column('athlete', UUID_ID(), nullable=False, index=True)
     sport = Column('sport', Enum(Sport))
     start = Column('start', BigInteger)
     end = Column('end', BigInteger)
@@ -93,6 +105,25 @@ class Session(Base):
     def find_by_athlete(cls, db, athlete):
         return db.query(cls).filter_by(athlete=athlete).all()
 
+    @classmethod
+    def find_by_athletes(cls, db, athletes):
+        return db.query(cls).filter(cls.athlete.in_(athletes)).all()
+
+    @classmethod
+    def dictionary_options(cls, events=True, readings=True):
+        sensors = selectinload(cls.sensors)
+        options = [sensors]
+        if readings:
+            options.append(sensors.selectinload(SensorPlacement.readings))
+        if events:
+            event = selectinload(cls.events)
+            options.extend([
+                event.selectinload(Event.subevents),
+                event.selectinload(Event.qualitative_attributes),
+                event.selectinload(Event.quantitative_attributes),
+            ])
+        return options
+
     @classmethod
     def get_session_sensors(cls, db, id):
         session = db.query(cls).filter_by(id=id).first()
@@ -133,7 +164,7 @@ class Session(Base):
             readings.extend(sensor.readings)
         return readings
 
-    def dictionary(self, db):
+    def dictionary(self, db, events=True, readings=True):
         """
         Returns dictionary of instance fields
 
@@ -141,16 +172,23 @@ class Session(Base):
         ----------
         db : sqlalchemy.Session
             Pass in sqlalchemy Session to lookup related fields
+        events : bool, optional
+            Include the session's events
+        readings : bool, optional
+            Include every reading of the session's sensors
         """
-        return {
+        session = {
             ID: str(self.id),
             ATHLETE_ID: str(self.athlete),
             SPORT: self.sport.value,
             START_TIME: self.start,
             END_TIME: self.end,
-            SENSOR_PLACEMENTS: [sensor.dictionary(db) for sensor in self.sensors],
-            EVENTS: [event.dictionary(db) for event in self.events]
+            SENSOR_PLACEMENTS: [sensor.dictionary(db, readings=readings)
+                                for sensor in self.sensors]
         }
+        if events:
+            session[EVENTS] = [event.dictionary(db) for event in self.events]
+        return session
 
     def __repr__(self):
         return "<Session(id='%s', athlete='%s, sport='%s', \
@@ -167,7 +205,8 @@ class Event(Base):
     id = Column('id', UUID_ID(), default=uuid.uuid4, nullable=False,
                 unique=True, primary_key=True)
     type = Column('type', String())
-    session = Column('session', UUID_ID(), ForeignKey('session.id'))
+    session = Column('session', UUID_ID(), ForeignKey('session.id'),
+                     index=True)
     start = Column('start', BigInteger)
     end = Column('end', BigInteger)
     bool_classifier = Column('bool_classifier', String())
@@ -217,7 +256,7 @@ class Subevent(Base):
 
     id = Column('id', UUID_ID(), default=uuid.uuid4, nullable=False,
                 unique=True, primary_key=True)
-    event = Column('event', UUID_ID(), ForeignKey('event.id'))
+    event = Column('event', UUID_ID(), ForeignKey('event.id'), index=True)
     type = Column('type', String, nullable=False)
     time = Column('value', BigInteger)
 
@@ -283,7 +322,7 @@ class QuantitativeAttribute(Base):
 
     id = Column('id', UUID_ID(), default=uuid.uuid4, nullable=False,
                 unique=True, primary_key=True)
-    event = Column('event', UUID_ID(), ForeignKey('event.id'))
+    event = Column('event', UUID_ID(), ForeignKey('event.id'), index=True)
     attribute = Column('attribute', String)
     units = Column('units', String)
     value = Column('value', Float)
@@ -331,9 +370,18 @@ class SensorPlacement(Base):
     id = Column('id', UUID_ID(), default=uuid.uuid4, nullable=False,
                 unique=True, primary_key=True)
     sensor = Column('sensor', String)
-    session = Column('session', UUID_ID(), ForeignKey('session.id'))
+    session = Column('session', UUID_ID(), ForeignKey('session.id'),
+                     index=True)
     location = Column('location', Enum(Location), nullable=False)
-    readings = relationship('Reading')
+    # Units are stored once per placement instead of on every reading
+    accelerometer_units = Column('accelerometer_units', String(length=10),
+                                 default=ACCELEROMETER_UNITS)
+    gyroscope_units = Column('gyroscope_units', String(length=10),
+                             default=GYROSCOPE_UNITS)
+    magnetometer_units = Column('magnetometer_units', String(length=10),
+                                default=MAGNETOMETER_UNITS)
+    readings = relationship('SensorReading', back_populates='placement',
+                            order_by='SensorReading.timestamp')
 
     def get_location_display(self):
         return str(self.location)
@@ -346,7 +394,7 @@ class SensorPlacement(Base):
                 break
         return found
 
-    def dictionary(self, db):
+    def dictionary(self, db, readings=True):
         """
         Returns dictionary of instance fields
 
@@ -354,14 +402,19 @@ class SensorPlacement(Base):
         ----------
         db : sqlalchemy.Session
             Pass in sqlalchemy Session to lookup related fields
+        readings : bool, optional
+            Include every reading of the placement
         """
-        return {
+        placement = {
             ID: str(self.id),
             SENSOR_ID: self.sensor,
             SESSION_ID: str(self.session),
-            LOCATION: self.location.value,
-            READINGS: [reading.dictionary(db) for reading in self.readings]
+            LOCATION: self.location.value
         }
+        if readings:
+            placement[READINGS] = [reading.dictionary(db, placement=self)
+                                   for reading in self.readings]
+        return placement
 
     def __repr__(self):
         return "<SensorPlacement(id='%s', session='%s', sensor='%s', \
@@ -372,8 +425,102 @@ class SensorPlacement(Base):
         return self.__repr__()
 
 
+class SensorReading(Base):
+    """
+    One sample from a sensor: accelerometer, gyroscope and magnetometer
+    x/y/z stored as nine REAL columns of a single row, keyed by the sensor
+    placement and timestamp. Units are kept on the SensorPlacement.
+
+    Replaces the Reading/AccelerometerReading/GyroscopeReading/
+    MagnetometerReading tables, which tools/migrate.py copies into this one.
+
+    ...
+
+    Attributes
+    ----------
+    CHANNELS : list[str]
+        Value column names, in the order of a reading buffer row
+    sensor : uuid4
+        Sensor placement the reading was recorded with
+    timestamp : int
+        Unix timestamp of the reading in ms
+    ax, ay, az : float
+        Accelerometer x/y/z
+    gx, gy, gz : float
+        Gyroscope x/y/z
+    mx, my, mz : float
+        Magnetometer x/y/z
+    """
+
+    CHANNELS = ['ax', 'ay', 'az', 'gx', 'gy', 'gz', 'mx', 'my', 'mz']
+
+    __tablename__ = 'sensor_reading'
+
+    sensor = Column('sensor', UUID_ID(), ForeignKey('sensor_placement.id'),
+                    primary_key=True)
+    timestamp = Column('timestamp', BigInteger, primary_key=True)
+    placement = relationship('SensorPlacement', back_populates='readings')
+    ax = Column('ax', REAL)
+    ay = Column('ay', REAL)
+    az = Column('az', REAL)
+    gx = Column('gx', REAL)
+    gy = Column('gy', REAL)
+    gz = Column('gz', REAL)
+    mx = Column('mx', REAL)
+    my = Column('my', REAL)
+    mz = Column('mz', REAL)
+
+    def dictionary(self, db, placement=None):
+        """
+        Returns dictionary of instance fields, in the same format as the
+        legacy Reading. The ID is a UUID derived from the sensor placement
+        and timestamp, so it is the same every time the reading is sent.
+
+        Parameters
+        ----------
+        db : sqlalchemy.Session
+            Pass in sqlalchemy Session to lookup related fields
+        placement : SensorPlacement, optional
+            The reading's placement, when the caller already has it
+        """
+        if placement is None:
+            placement = self.placement
+        return {
+            ID: str(uuid.uuid5(placement.id, str(self.timestamp))),
+            SENSOR_ID: placement.sensor,
+            TIME: self.timestamp,
+            ACCELEROMETER: {
+                X: self.ax, Y: self.ay, Z: self.az,
+                UNITS: placement.accelerometer_units
+            },
+            GYROSCOPE: {
+                X: self.gx, Y: self.gy, Z: self.gz,
+                UNITS: placement.gyroscope_units
+            },
+            MAGNETOMETER: {
+                X: self.mx, Y: self.my, Z: self.mz,
+                UNITS: placement.magnetometer_units
+            }
+        }
+
+    def __repr__(self):
+        return "<SensorReading(sensor='%s', time=%s)>" % (
+            self.sensor, self.timestamp)
+
+    def __str__(self):
+        return self.__repr__()
+
+
+##
+# Legacy reading layout: one row per reading plus one per sensor type.
+# Only read by tools/migrate.py.
+##
 class Reading(Base):
     __tablename__ = 'reading'
+    __table_args__ = (
+        Index('ix_reading_sensor_timestamp', 'sensor', 'timestamp',
+              unique=True),
+    )
     
     id = Column('id', UUID_ID(), default=uuid.uuid4, nullable=False,
                 unique=True, primary_key=True)
@@ -386,7 +533,7 @@ class Reading(Base):
     magnetometer = relationship('MagnetometerReading', uselist=False,
                                 back_populates='reading')
 
-    def dictionary(self, db):
+    def dictionary(self, db, placement=None):
         """
         Returns dictionary of instance fields
 
@@ -394,8 +541,12 @@ class Reading(Base):
         ----------
         db : sqlalchemy.Session
             Pass in sqlalchemy Session to lookup related fields
+        placement : SensorPlacement, optional
+            The reading's placement, when the caller already has it
         """
-        placement = db.query(SensorPlacement).filter_by(id=self.sensor).one()
+        if placement is None:
+            placement = db.query(SensorPlacement).filter_by(
+                id=self.sensor).one()
         return {
             ID: str(self.id),
             SENSOR_ID: placement.sensor,
@@ -414,7 +565,7 @@ class Reading(Base):
 
 
 class AccelerometerReading(Base):
-    UNITS = 'm/s^2'
+    UNITS = ACCELEROMETER_UNITS
 
     __tablename__ = 'accelerometer_reading'
 
@@ -455,7 +606,7 @@ class AccelerometerReading(Base):
 
 
 class GyroscopeReading(Base):
-    UNITS = 'deg/sec'
+    UNITS = GYROSCOPE_UNITS
 
     __tablename__ = 'gyroscope_reading'
 
@@ -496,7 +647,7 @@ class GyroscopeReading(Base):
 
 
 class MagnetometerReading(Base):
-    UNITS = 'microtesla'
+    UNITS = MAGNETOMETER_UNITS
 
     __tablename__ = 'magnetometer_reading'
 
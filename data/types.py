@@ -27,10 +27,10 @@ class UUID_ID(TypeDecorator):
             return str(value)
         else:
             if not isinstance(value, uuid.UUID):
-                return "%.32x" % uuid.UUID(value)
+                return "%.32x" % uuid.UUID(str(value)).int
             else:
                 # hexstring
-                return "%.32x" % value
+                return "%.32x" % value.int
 
     def process_result_value(self, value, dialect):
         if value is None:
@@ -1,11 +1,18 @@
 #!/usr/bin/env python3
 
+from datetime import datetime
 import os
+import tempfile
 
 from aiohttp import web
 
+from data import models
+from model_keys import SPORT
+
 
 class BaseHandler:
+    UPLOAD_CHUNK_SIZE = 1 << 16
+
     def __init__(self, analyzer, bool_clf_dir, type_clf_dir):
         self.analyzer = analyzer
         self.bool_clf_dir = bool_clf_dir
@@ -14,30 +21,68 @@ class BaseHandler:
     def index(self, request):
         return web.Response(text='Please connect using socket.io too.')
 
-    async def add_bool_classifier(self, request):
-        data = await request.post()
-        pkl = data['clf']
-        content = pkl.file.read()
-
-        filename = os.path.join(self.bool_clf_dir, pkl.filename)
+    async def analyzer_stats(self, request):
+        return web.json_response({
+            'prefilter': self.analyzer.get_prefilter_stats(),
+            'models': self.analyzer.registry.get_stats()
+        })
 
-        with open(filename, 'wb') as f:
-            f.write(content)
-            f.close()
-        self.analyzer.load_bool(filename)
-
-        return web.Response(text='Saved classifier {}'.format(pkl.filename))
+    async def add_bool_classifier(self, request):
+        return await self._add_classifier(
+            request, self.analyzer.BOOL, self.bool_clf_dir,
+            self.analyzer.swap_bool)
 
     async def add_type_classifier(self, request):
-        data = await request.post()
-        pkl = data['clf']
-        content = pkl.file.read()
+        return await self._add_classifier(
+            request, self.analyzer.TYPE, self.type_clf_dir,
+            self.analyzer.swap_type)
+
+    async def _add_classifier(self, request, kind, clf_dir, swap):
+        # With ?sport=<name> the upload becomes the sport's latest model in
+        # the registry instead of the default classifier
+        sport = request.query.get(SPORT)
+        if sport is not None and \
+                sport not in [str(s) for s in models.Session.Sport]:
+            raise web.HTTPBadRequest(text='Unknown sport {}'.format(sport))
 
-        filename = os.path.join(self.type_clf_dir, pkl.filename)
+        # Streamed to a temporary file so a partial or broken upload never
+        # replaces a classifier, nor is picked up as the latest one
+        reader = await request.multipart()
+        field = await reader.next()
+        while field is not None and field.name != 'clf':
+            field = await reader.next()
+        if field is None or not field.filename:
+            raise web.HTTPBadRequest(text='clf file is required')
 
-        with open(filename, 'wb') as f:
-            f.write(content)
-            f.close()
-        self.analyzer.load_type(filename)
+        name = os.path.basename(field.filename)
+        if sport is not None and not name.endswith('.pkl'):
+            raise web.HTTPBadRequest(text='Sport models must be .pkl files')
+        handle, part = tempfile.mkstemp(suffix='.part', dir=clf_dir)
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                while True:
+                    chunk = await field.read_chunk(self.UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+            if sport is None:
+                timings = await swap(part, dest=os.path.join(clf_dir, name))
+            else:
+                timings = await self.analyzer.registry.install(
+                    kind, sport, part, name)
+        except Exception as e:
+            raise web.HTTPBadRequest(
+                text='Could not load classifier {}: {}'.format(name, e))
+        finally:
+            if os.path.exists(part):
+                os.remove(part)
 
-        return web.Response(text='Saved classifier {}'.format(pkl.filename))
+        print('{} -- Swapped in classifier {} in {:.3f}s '
+              '(load {:.3f}s, warm-up {:.3f}s)'.format(
+                  datetime.now(), name, timings['total'], timings['load'],
+                  timings['warm_up']))
+        return web.Response(
+            text='Saved classifier {} in {:.3f}s (load {:.3f}s, '
+                 'warm-up {:.3f}s)'.format(name, timings['total'],
+                                          timings['load'],
+                                          timings['warm_up']))
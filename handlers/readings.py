@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+from aiohttp import web
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import io
+import json
+import numpy as np
+import uuid
+
+from data import models
+from model_keys import *
+from settings import EXPORT_WORKERS, PLOT_MAX_POINTS
+from tools import downsample
+from tools.errors import ExportError
+from tools.export import SessionExporter
+
+
+class ReadingHandler:
+    """
+    HTTP endpoints serving slices of a session's readings, e.g. for plots.
+
+    ...
+
+    Attributes
+    ----------
+    db : DBManager
+        Database the readings are read from
+    exporter : SessionExporter
+        Writes exports from the database's engine
+    export_executor : ThreadPoolExecutor
+        Threads exports run in, so a long export does not hold one of the
+        database's workers
+
+    Methods
+    -------
+    reading_slice(request:aiohttp.web.Request)
+        GET /readings?session=<id>&sensor=<serial>[&start=<ms>][&end=<ms>]
+        [&channels=ax,ay,...][&points=<n>][&method=lttb|minmax]
+        Returns the sensor's readings between start and end as JSON, one
+        {time: [...], value: [...]} series per channel. With points, each
+        channel is downsampled to about that many samples.
+    export(request:aiohttp.web.Request)
+        GET /export?session=<id>&athlete=<id>[&format=parquet|arrow|npz]
+        Streams a zip archive of the sessions exported by SessionExporter,
+        as it is written. session and athlete can be repeated; at least one
+        is required.
+    shutdown()
+        Stops the export threads
+    """
+
+    EXPORT_WRITE_SIZE = 1 << 20
+
+    def __init__(self, db):
+        self.db = db
+        self.exporter = SessionExporter(db.engine)
+        self.export_executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS)
+
+    def _int_param(self, request, name, default=None):
+        value = request.query.get(name)
+        if value is None:
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            raise web.HTTPBadRequest(
+                text='{} must be an integer'.format(name))
+
+    def _check_uuid(self, name, value):
+        try:
+            uuid.UUID(value)
+        except ValueError:
+            raise web.HTTPBadRequest(text='{} must be a uuid'.format(name))
+        return value
+
+    async def reading_slice(self, request):
+        session_id = request.query.get(SESSION_ID)
+        sensor_id = request.query.get(SENSOR_ID)
+        if session_id is None or sensor_id is None:
+            raise web.HTTPBadRequest(
+                text='{} and {} are required'.format(SESSION_ID, SENSOR_ID))
+        self._check_uuid(SESSION_ID, session_id)
+        start = self._int_param(request, START_TIME)
+        end = self._int_param(request, END_TIME)
+        points = self._int_param(request, POINTS)
+        method = request.query.get(METHOD, downsample.LTTB)
+        if method not in downsample.METHODS:
+            raise web.HTTPBadRequest(
+                text='{} must be one of {}'.format(
+                    METHOD, ', '.join(downsample.METHODS)))
+        if points is not None and not 2 < points <= PLOT_MAX_POINTS:
+            raise web.HTTPBadRequest(
+                text='{} must be between 3 and {}'.format(
+                    POINTS, PLOT_MAX_POINTS))
+
+        channels = models.SensorReading.CHANNELS
+        if CHANNELS in request.query:
+            channels = request.query[CHANNELS].split(',')
+            unknown = set(channels) - set(models.SensorReading.CHANNELS)
+            if unknown:
+                raise web.HTTPBadRequest(
+                    text='Unknown channels {}'.format(
+                        ', '.join(sorted(unknown))))
+
+        body = await self.db.run(self._slice_body, session_id, sensor_id,
+                                 start, end, channels, points, method)
+        if body is None:
+            raise web.HTTPNotFound(
+                text='No sensor {} in session {}'.format(
+                    sensor_id, session_id))
+        return web.Response(body=body, content_type='application/json')
+
+    def _slice_body(self, session_id, sensor_id, start, end, channels,
+                    points, method):
+        # Runs in the database workers: downsampling and serializing a long
+        # slice would otherwise stall the event loop
+        readings = self.db.get_reading_slice(session_id, sensor_id, start, end)
+        if readings is None:
+            return None
+        timestamps, values = readings
+
+        series = {}
+        for channel in channels:
+            column = values[:, models.SensorReading.CHANNELS.index(channel)]
+            if points is None:
+                kept = np.arange(len(timestamps))
+            else:
+                kept = downsample.downsample(timestamps, column, points,
+                                             method=method)
+            series[channel] = {
+                TIME: timestamps[kept].tolist(),
+                VALUE: column[kept].tolist()
+            }
+
+        return json.dumps({
+            SESSION_ID: session_id,
+            SENSOR_ID: sensor_id,
+            START_TIME: start,
+            END_TIME: end,
+            COUNT: len(timestamps),
+            METHOD: method if points is not None else None,
+            CHANNELS: series
+        }).encode('utf-8')
+
+    async def export(self, request):
+        sessions = request.query.getall(SESSION_ID, [])
+        athletes = request.query.getall(ATHLETE_ID, [])
+        fmt = request.query.get(FORMAT, SessionExporter.PARQUET)
+        if not sessions and not athletes:
+            raise web.HTTPBadRequest(
+                text='{} or {} is required'.format(SESSION_ID, ATHLETE_ID))
+        for session_id in sessions:
+            self._check_uuid(SESSION_ID, session_id)
+        for athlete in athletes:
+            self._check_uuid(ATHLETE_ID, athlete)
+
+        try:
+            self.exporter.check_format(fmt)
+        except ExportError as e:
+            raise web.HTTPBadRequest(text=str(e))
+
+        loop = asyncio.get_event_loop()
+        sessions = await loop.run_in_executor(
+            self.export_executor, self.exporter.find_sessions, sessions,
+            athletes)
+        response = web.StreamResponse(headers={
+            'Content-Type': 'application/zip',
+            'Content-Disposition':
+                'attachment; filename="export-{}.zip"'.format(fmt)
+        })
+        await response.prepare(request)
+        # The archive is written by an export thread straight into the
+        # response, a buffer at a time
+        out = io.BufferedWriter(_ResponseWriter(response, loop),
+                                buffer_size=self.EXPORT_WRITE_SIZE)
+        try:
+            await loop.run_in_executor(
+                self.export_executor, self.exporter.write_archive, out,
+                sessions, fmt)
+        except Exception as e:
+            # Too late for an error status, the client gets a truncated
+            # archive
+            print('{} -- Export failed: {}'.format(datetime.now(), e))
+            raise
+        await response.write_eof()
+        return response
+
+    def shutdown(self):
+        self.export_executor.shutdown(wait=False)
+
+
+class _ResponseWriter(io.RawIOBase):
+    # Writable stream over a StreamResponse for an export thread: each
+    # write waits until the event loop has sent the data, so a slow client
+    # slows the export down instead of filling memory
+
+    def __init__(self, response, loop):
+        self.response = response
+        self.loop = loop
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        asyncio.run_coroutine_threadsafe(
+            self.response.write(data), self.loop).result()
+        return len(data)
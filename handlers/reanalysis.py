@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+from aiohttp import web
+import asyncio
+from datetime import datetime
+import os
+import uuid
+
+from data import models
+from model_keys import *
+from tools.errors import AnalyzerError
+from tools.reanalyze import SessionReanalyzer
+
+
+class ReanalysisHandler:
+    """
+    HTTP endpoints re-analyzing stored sessions with new classifiers in the
+    background, one job at a time.
+
+    ...
+
+    Attributes
+    ----------
+    db : DBManager
+        Database the sessions are read from and events written to
+    analyzer : Analyzer
+        Analyzer whose current classifiers are used by default
+    bool_clf_dir : str
+        Directory bool classifiers are uploaded to
+    type_clf_dir : str
+        Directory type classifiers are uploaded to
+    status : dict
+        Progress of the latest job
+
+    Methods
+    -------
+    start(request:aiohttp.web.Request)
+        POST /reanalyze[?session=<id>][&athlete=<id>][&sport=<name>]
+        [&bool_classifier=<file>][&type_classifier=<file>]
+        Starts re-analyzing the sessions (every session if none are
+        requested) with the classifier files, by default the ones the
+        analyzer uses for the sport. Sessions still recording are skipped.
+        Returns the job's status, 409 if a job is already running.
+    get_status(request:aiohttp.web.Request)
+        GET /reanalyze
+        Returns the latest job's status
+    """
+
+    def __init__(self, db, analyzer, bool_clf_dir, type_clf_dir):
+        self.db = db
+        self.analyzer = analyzer
+        self.bool_clf_dir = bool_clf_dir
+        self.type_clf_dir = type_clf_dir
+        self.status = {RUNNING: False}
+        self._task = None
+
+    def _current_clfs(self, sport):
+        # The sport's latest models when it has its own, else the defaults
+        clfs = []
+        for kind, key in [(self.analyzer.BOOL, self.analyzer.bool_clf_key),
+                          (self.analyzer.TYPE, self.analyzer.type_clf_key)]:
+            path = None
+            if sport is not None and self.analyzer.registry is not None:
+                path = self.analyzer.registry.resolve(kind, sport)
+            if path is None and key is not None:
+                path = key[0]
+            clfs.append(path)
+        return clfs
+
+    def _recording(self):
+        # Live sessions are keyed by their id as the client sent it, in
+        # whatever case
+        recording = set()
+        for id in list(self.db.sessions):
+            try:
+                recording.add(uuid.UUID(str(id)))
+            except ValueError:
+                pass
+        return recording
+
+    def _clf_file(self, request, key, clf_dir, current):
+        name = request.query.get(key)
+        if name is None:
+            return current
+        filename = os.path.join(clf_dir, os.path.basename(name))
+        if not os.path.isfile(filename):
+            raise web.HTTPBadRequest(text='No classifier {}'.format(name))
+        return filename
+
+    async def start(self, request):
+        if self.status[RUNNING]:
+            raise web.HTTPConflict(text='A re-analysis is already running')
+
+        # Named as in classifier uploads
+        sport = request.query.get(SPORT)
+        if sport is not None and \
+                sport not in [str(s) for s in models.Session.Sport]:
+            raise web.HTTPBadRequest(text='Unknown sport {}'.format(sport))
+        bool_clf, type_clf = self._current_clfs(sport)
+        bool_file = self._clf_file(request, BOOL_CLASSIFIER,
+                                   self.bool_clf_dir, bool_clf)
+        type_file = self._clf_file(request, TYPE_CLASSIFIER,
+                                   self.type_clf_dir, type_clf)
+        try:
+            reanalyzer = SessionReanalyzer(bool_file, type_file)
+        except AnalyzerError as e:
+            raise web.HTTPBadRequest(text=str(e))
+
+        # Claimed before the first await, so a concurrent request gets 409
+        self.status = {RUNNING: True}
+        try:
+            sessions = await self.db.run(
+                reanalyzer.find_sessions, self.db.engine,
+                request.query.getall(SESSION_ID, []),
+                request.query.getall(ATHLETE_ID, []), sport)
+        except Exception:
+            self.status = {RUNNING: False}
+            raise
+        recording = self._recording()
+        sessions = [id for id in sessions
+                    if uuid.UUID(str(id)) not in recording]
+
+        self.status = {
+            RUNNING: True,
+            BOOL_CLASSIFIER: reanalyzer.bool_name,
+            TYPE_CLASSIFIER: reanalyzer.type_name,
+            COUNT: len(sessions),
+            DONE: 0,
+            EVENTS: 0,
+            ERROR: None
+        }
+        self._task = asyncio.ensure_future(self._run(reanalyzer, sessions))
+        return web.json_response(self.status, status=202)
+
+    async def get_status(self, request):
+        return web.json_response(self.status)
+
+    def _progress(self, session_id, events):
+        # Called from the job's thread
+        self.status[DONE] += 1
+        self.status[EVENTS] += events
+
+    async def _run(self, reanalyzer, sessions):
+        print('{} -- Re-analyzing {} sessions with {}, {}'.format(
+            datetime.now(), len(sessions), reanalyzer.bool_name,
+            reanalyzer.type_name))
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(None, reanalyzer.reanalyze, sessions,
+                                       self._progress)
+        except Exception as e:
+            print('{} -- Re-analysis failed: {}'.format(datetime.now(), e))
+            self.status[ERROR] = str(e)
+        finally:
+            self.status[RUNNING] = False
+        print('{} -- Re-analysis wrote {} events'.format(
+            datetime.now(), self.status[EVENTS]))
@@ -8,19 +8,31 @@ ATHLETE_ID              = 'athlete'
 ATTRIBUTE               = 'attribute'
 AVERAGE                 = 'average'
 BOOL_CLASSIFIER         = 'bool_classifier'
+CHANNELS                = 'channels'
+COUNT                   = 'count'
+CURSOR                  = 'cursor'
 DATA_TYPE               = 'data_type'
+DETAIL                  = 'detail'
+DONE                    = 'done'
 END_TIME                = 'end'
+ERROR                   = 'error'
 EVENTS                  = 'events'
 EVENT_ID                = 'event_id'
+FORMAT                  = 'format'
 GYROSCOPE               = 'gyroscope'
 ID                      = 'id'
+LIMIT                   = 'limit'
 LOCATION                = 'location'
 MAGNETOMETER            = 'magnetometer'
 MEASUREMENT             = 'measurement'
+METHOD                  = 'method'
+NEXT_CURSOR             = 'next_cursor'
+POINTS                  = 'points'
 QUALITATIVE_ATTRIBUTES  = 'qual_attributes'
 QUANTITATIVE_ATTRIBUTES = 'quan_attributes'
 READINGS                = 'readings'
 READING_ID              = 'reading'
+RUNNING                 = 'running'
 SENSOR_ID               = 'sensor'
 SENSOR_PLACEMENTS       = 'placements'
 SESSION_ID              = 'session'
@@ -11,8 +11,13 @@ import uuid
 from model_keys import *
 from settings import *
 from handlers.base import BaseHandler
+from handlers.readings import ReadingHandler
+from handlers.reanalysis import ReanalysisHandler
 from tools.analyzer import Analyzer
 from tools.db import DBManager
+from tools.errors import FrameError
+from tools.frames import Frame
+from tools.registry import ModelRegistry
 
 EVENT_LOOP = asyncio.get_event_loop()
 
@@ -31,8 +36,11 @@ class IOServer:
     CLIENT_DATA               = 'client_data'
     START_SESSION             = 'start_session'
     READING_ENTRY             = 'reading_entry'
+    READING_BATCH             = 'reading_batch'
+    READING_FRAME             = 'reading_frame'
     END_SESSION               = 'end_session'
     CLIENT_REQUEST            = 'request_data'
+    READINGS_REQUEST          = 'request_readings'
 
     ###
     # Server Events
@@ -44,6 +52,7 @@ class IOServer:
     SERVER_DATA               = 'server_data'
     ANALYZED_DATA             = 'analyzed_data'
     REQUEST_RESPONSE          = 'request_response'
+    READINGS_RESPONSE         = 'readings_response'
 
 
     def __init__(self, bool_clf_dir=BOOL_CLF_DIR, type_clf_dir=TYPE_CLF_DIR):
@@ -57,9 +66,17 @@ class IOServer:
 
         self.analyzer = Analyzer(pickled_bool_clf=bool_clf,
                                  pickled_type_clf=type_clf)
+        # Sports with their own models are routed to them, loaded on use
+        self.analyzer.registry = ModelRegistry(
+            self.analyzer, bool_clf_dir, type_clf_dir)
 
         # Setup database to store sessions. Load stored sessions.
-        self.db = DBManager()
+        self.db = DBManager(window_size=max(
+            self.analyzer.bool_window_size, self.analyzer.type_window_size))
+        self.app.on_startup.append(self.start_flushing)
+        self.app.on_cleanup.append(self.stop_flushing)
+        self._flush_task = None
+        self._flush_wakeup = None
 
         # Setup Handlers
         base_handler = BaseHandler(self.analyzer, bool_clf_dir, type_clf_dir)
@@ -68,6 +85,19 @@ class IOServer:
             '/bool-classifier', handler=base_handler.add_bool_classifier)
         self.app.router.add_post(
             '/type-classifier', handler=base_handler.add_type_classifier)
+        self.app.router.add_get(
+            '/analyzer-stats', handler=base_handler.analyzer_stats)
+        reading_handler = ReadingHandler(self.db)
+        self.app.router.add_get(
+            '/readings', handler=reading_handler.reading_slice)
+        self.app.router.add_get('/export', handler=reading_handler.export)
+        self.reading_handler = reading_handler
+        reanalysis_handler = ReanalysisHandler(
+            self.db, self.analyzer, bool_clf_dir, type_clf_dir)
+        self.app.router.add_post(
+            '/reanalyze', handler=reanalysis_handler.start)
+        self.app.router.add_get(
+            '/reanalyze', handler=reanalysis_handler.get_status)
 
         # Setup Socket IO
         self.init_socketio()
@@ -82,8 +112,128 @@ class IOServer:
     def serve(self, port=PORT):
         web.run_app(self.app, port=port)
 
-    async def send(self, event, data):
-        await self.sio.emit(event, data)
+    async def send(self, event, data, room=None):
+        await self.sio.emit(event, data, room=room)
+
+    def session_room(self, session_id):
+        # Recording client of a session, for its per-window results
+        return 'session:{}'.format(session_id)
+
+    def athlete_room(self, athlete):
+        # Clients following an athlete (the recording client and any that
+        # requested the athlete's data), for the events found
+        return 'athlete:{}'.format(str(athlete).lower())
+
+    async def start_flushing(self, app):
+        self._flush_wakeup = asyncio.Event()
+        self._flush_task = asyncio.ensure_future(self.flush_readings())
+
+    async def stop_flushing(self, app):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+
+    def schedule_flush(self, session_id, sensor_id):
+        # Wake the flush task early once a sensor has FLUSH_ROWS unwritten
+        if self._flush_wakeup is not None and \
+                self.db.needs_flush(session_id, sensor_id):
+            self._flush_wakeup.set()
+
+    async def flush_readings(self):
+        """
+        Background task writing the readings of recording sessions to the
+        database every FLUSH_INTERVAL seconds, or sooner when a sensor has
+        FLUSH_ROWS readings waiting.
+        """
+
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_wakeup.wait(),
+                                       timeout=FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_wakeup.clear()
+            try:
+                flushed = await self.db.run(self.db.flush_sessions)
+            except Exception as e:
+                print('{} -- Flushing readings failed: {}'.format(
+                    datetime.now(), e))
+                continue
+            if flushed > 0:
+                print('{} -- Flushed {} readings'.format(
+                    datetime.now(), flushed))
+
+    async def analyze_readings(self, session_id, sensor_id, previous, count):
+        """
+        Analyzes every window whose boundary was crossed when the sensor's
+        reading count went from previous to count.
+        """
+
+        # Copy windows out before awaiting, the buffer may be compacted by
+        # readings that arrive in the meantime
+        size = max(self.analyzer.bool_window_size,
+                   self.analyzer.type_window_size)
+        windows = []
+        for reading_count in self.analyzer.bool_analysis_points(previous, count):
+            timestamps, window = self.db.get_window(
+                session_id, sensor_id, size, end=reading_count)
+            windows.append((reading_count, timestamps.copy(), window.copy()))
+
+        for reading_count, timestamps, window in windows:
+            await self.analyze_window(session_id, reading_count,
+                                      timestamps, window)
+
+    async def analyze_window(self, session_id, reading_count, timestamps,
+                             window):
+        size = self.analyzer.bool_window_size
+        start_time, end_time = int(timestamps[-size:][0]), int(timestamps[-1])
+
+        session = self.db.get_live_session(session_id)
+        if session is None:
+            session = await self.db.run(self.db.get_session, session_id)
+        sport = session.get_sport_display()
+        found_event = await self.analyzer.is_event(window[-size:], sport=sport)
+        print('found event analysis: {}'.format(found_event))
+
+        athlete = session.athlete
+        bool_clf = self.analyzer.get_bool_clf_name(sport)
+        if found_event:
+            print('{} -> {} -- FOUND_EVENT'.format(start_time, end_time))
+            event_id = uuid.uuid4()
+            await self.send(self.EVENT_FOUND, {
+                EVENT_ID: str(event_id),
+                SESSION_ID: session_id,
+                ATHLETE_ID: str(athlete),
+                BOOL_CLASSIFIER: bool_clf,
+                START_TIME: start_time,
+                END_TIME: end_time
+            }, room=self.athlete_room(athlete))
+        else:
+            print('{} -> {} -- NO EVENT FOUND'.format(start_time, end_time))
+            await self.send(self.EVENT_NOT_FOUND, {
+                START_TIME: start_time,
+                END_TIME: end_time
+            }, room=self.session_room(session_id))
+
+        # Run type classifier to predict event
+        if found_event and self.analyzer.type_can_analyze(reading_count):
+            size = self.analyzer.type_window_size
+            event_type = await self.analyzer.predict_event_type(
+                window[-size:], sport=sport)
+            type_clf = self.analyzer.get_type_clf_name(sport)
+            print('{} -- {} -- SEND_EVENT={}'.format(
+                datetime.now(), self.READING_ENTRY, event_type))
+
+            event_args = (event_id, session_id, event_type,
+                          int(timestamps[-size:][0]), int(timestamps[-1]),
+                          bool_clf, type_clf)
+            if self.db.is_recording(session_id):
+                event = self.db.add_event(*event_args)
+            else:
+                event = await self.db.run(self.db.add_event, *event_args)
+
+            # A new event has no related rows to look up
+            await self.send(self.EVENT_DATA, event.dictionary(None),
+                            room=self.athlete_room(athlete))
 
     def save_data(self, file, data):
         file = open(file, 'a')
@@ -94,7 +244,7 @@ class IOServer:
         @self.sio.on(self.CONNECT)
         async def connect(sid, environ):
             print('{} -- ID={} -- {}'.format(datetime.now(), sid, self.CONNECT))
-            await self.send(self.HEARTBEAT, {self.HEARTBEAT: '1'})
+            await self.send(self.HEARTBEAT, {self.HEARTBEAT: '1'}, room=sid)
             self.sockets.append(sid)
 
         @self.sio.on(self.CONNECT_ERROR)
@@ -103,91 +253,140 @@ class IOServer:
             print('\tdata={}'.format(data))
 
         @self.sio.on(self.START_SESSION)
-        def start_session(sid, data):
+        async def start_session(sid, data):
             print('{} -- ID={} -- {}'.format(datetime.now(), sid, self.START_SESSION))
             print('\tdata={}'.format(data))
+            self.sio.enter_room(sid, self.session_room(data[ID]))
+            self.sio.enter_room(sid, self.athlete_room(data[ATHLETE_ID]))
+            # Readings are accepted right away, and flushed once it is saved
             self.db.start_session(data[ID], data[ATHLETE_ID], data[SPORT],
                                   data[START_TIME],
                                   placements=data[SENSOR_PLACEMENTS])
+            await self.db.run(self.db.create_session, data[ID])
 
         @self.sio.on(self.READING_ENTRY)
         async def receive_reading(sid, data):
             #print('{} -- ID={} -- {}, data={}'.format(datetime.now(), sid, self.READING_ENTRY, data))
             # Unpack for db
-            self.db.add_reading(
+            added = self.db.add_reading(
                 data[SESSION_ID], data[SENSOR_ID], uuid.uuid4(),
                 data[TIME], data[ACCELEROMETER],
                 data[GYROSCOPE], data[MAGNETOMETER])
-
-            reading_count = self.db.get_reading_count(data[SESSION_ID])
-            if self.analyzer.bool_can_analyze(reading_count):
-                start = -1*self.analyzer.bool_window_size # Only analyze latest window
-                readings = self.db.get_readings(data[SESSION_ID])[start:]
-
-                found_event = await self.analyzer.is_event(readings)
-                print('found event analysis: {}'.format(found_event))
-
-                athlete = self.db.get_session(data[SESSION_ID]).athlete
-                bool_clf = self.analyzer.get_bool_clf_name()
-                if found_event:
-                    print('{} -> {} -- FOUND_EVENT'.format(
-                        readings[0].timestamp, readings[-1].timestamp))
-                    event_id = uuid.uuid4()
-                    await self.send(self.EVENT_FOUND, {
-                        EVENT_ID: str(event_id),
-                        SESSION_ID: data[SESSION_ID],
-                        ATHLETE_ID: str(athlete),
-                        BOOL_CLASSIFIER: bool_clf,
-                        START_TIME: readings[0].timestamp,
-                        END_TIME: readings[-1].timestamp
-                    })
-                else:
-                    print('{} -> {} -- NO EVENT FOUND'.format(
-                        readings[0].timestamp, readings[-1].timestamp))
-                    await self.send(self.EVENT_NOT_FOUND, {
-                        START_TIME: readings[0].timestamp,
-                        END_TIME: readings[-1].timestamp
-                    })
-
-                # Run type classifier to predict event
-                if found_event and self.analyzer.type_can_analyze(reading_count):                    
-                    start = -1*self.analyzer.type_window_size # Only analyze latest window
-                    readings = self.db.get_readings(data[SESSION_ID])[start:]
-                    event_type = await self.analyzer.predict_event_type(
-                        readings)
-                    type_clf = self.analyzer.get_type_clf_name()
-                    print('{} -- {} -- SEND_EVENT={}'.format(
-                        datetime.now(), self.READING_ENTRY, event_type))
-                    
-                    event = self.db.add_event(
-                        event_id, data[SESSION_ID], event_type,
-                        readings[0].timestamp, readings[-1].timestamp,
-                        bool_clf, type_clf)
-
-                    await self.send(self.EVENT_DATA,
-                                    event.dictionary(self.db.db))
+            if not added:
+                return
+
+            self.schedule_flush(data[SESSION_ID], data[SENSOR_ID])
+            # Windows are per sensor, so schedule on the sensor's count
+            reading_count = self.db.get_reading_count(
+                data[SESSION_ID], data[SENSOR_ID])
+            await self.analyze_readings(data[SESSION_ID], data[SENSOR_ID],
+                                        reading_count - 1, reading_count)
+
+        @self.sio.on(self.READING_BATCH)
+        async def receive_batch(sid, data):
+            readings = data[READINGS]
+            if len(readings) == 0:
+                return
+
+            timestamps, values = [], []
+            for reading in readings:
+                accel, gyro, mag = reading[ACCELEROMETER], \
+                    reading[GYROSCOPE], reading[MAGNETOMETER]
+                timestamps.append(reading[TIME])
+                values.append([accel[X], accel[Y], accel[Z],
+                               gyro[X], gyro[Y], gyro[Z],
+                               mag[X], mag[Y], mag[Z]])
+            units = (readings[0][ACCELEROMETER][UNITS],
+                     readings[0][GYROSCOPE][UNITS],
+                     readings[0][MAGNETOMETER][UNITS])
+
+            if not self.db.is_recording(data[SESSION_ID]):
+                return
+            previous = self.db.get_reading_count(
+                data[SESSION_ID], data[SENSOR_ID])
+            added = self.db.add_readings(data[SESSION_ID], data[SENSOR_ID],
+                                         timestamps, values, units)
+            if added > 0:
+                self.schedule_flush(data[SESSION_ID], data[SENSOR_ID])
+                await self.analyze_readings(data[SESSION_ID], data[SENSOR_ID],
+                                            previous, previous + added)
+
+        @self.sio.on(self.READING_FRAME)
+        async def receive_frame(sid, data):
+            try:
+                frame = Frame.decode(data)
+            except FrameError as e:
+                print('{} -- ID={} -- {} -- {}'.format(
+                    datetime.now(), sid, self.READING_FRAME, e))
+                return
+
+            if not self.db.is_recording(frame.session):
+                return
+            previous = self.db.get_reading_count(frame.session, frame.sensor)
+            added = self.db.add_readings(frame.session, frame.sensor,
+                                         frame.timestamps(), frame.values,
+                                         Frame.UNITS)
+            if added > 0:
+                self.schedule_flush(frame.session, frame.sensor)
+                await self.analyze_readings(frame.session, frame.sensor,
+                                            previous, previous + added)
 
         @self.sio.on(self.HEARTBEAT)
         async def send_heartbeat(sid, data):
             print('{} -- ID={} -- {}'.format(datetime.now(), sid, self.HEARTBEAT))
-            await self.send(self.HEARTBEAT, {self.HEARTBEAT: '1'})
+            await self.send(self.HEARTBEAT, {self.HEARTBEAT: '1'}, room=sid)
 
         @self.sio.on(self.END_SESSION)
-        def end_session(sid, data):
+        async def end_session(sid, data):
             print('{} -- ID={} -- {}'.format(datetime.now(), sid, self.END_SESSION))
             print('\tdata={}'.format(data))
-            self.db.end_session(data[ID], data[END_TIME])
+            live = self.db.end_session(data[ID], data[END_TIME])
+            await self.sio.close_room(self.session_room(data[ID]))
+            if live is not None:
+                await self.db.run(self.db.save_session, live)
 
         @self.sio.on(self.CLIENT_REQUEST)
         async def handle_request(sid, data):
             print('{} -- ID={} -- {}'.format(
                 datetime.now(), sid, self.CLIENT_REQUEST))
             print('\tdata={}'.format(data))
-            sessions = self.db.get_all_sessions(data[ATHLETE_ID])
+            # Follow the athletes for the events found from now on
+            for athlete in data[ATHLETE_ID]:
+                self.sio.enter_room(sid, self.athlete_room(athlete))
+            # Full detail unless asked otherwise, as before pagination
+            try:
+                sessions, cursor = await self.db.run(
+                    self.db.get_session_page, data[ATHLETE_ID],
+                    data.get(DETAIL, DBManager.DETAIL_READINGS),
+                    data.get(CURSOR), data.get(LIMIT))
+            except ValueError as e:
+                print('{} -- ID={} -- {} -- {}'.format(
+                    datetime.now(), sid, self.CLIENT_REQUEST, e))
+                return
             await self.send(self.REQUEST_RESPONSE, {
-                SESSION_ID: [
-                    session.dictionary(self.db.db) for session in sessions]
-            })
+                SESSION_ID: sessions,
+                NEXT_CURSOR: cursor
+            }, room=sid)
+
+        @self.sio.on(self.READINGS_REQUEST)
+        async def handle_readings_request(sid, data):
+            print('{} -- ID={} -- {}'.format(
+                datetime.now(), sid, self.READINGS_REQUEST))
+            print('\tdata={}'.format(data))
+            try:
+                readings, cursor = await self.db.run(
+                    self.db.get_reading_page, data[SESSION_ID],
+                    data.get(SENSOR_ID), data.get(START_TIME),
+                    data.get(END_TIME), data.get(CURSOR), data.get(LIMIT))
+            except ValueError as e:
+                print('{} -- ID={} -- {} -- {}'.format(
+                    datetime.now(), sid, self.READINGS_REQUEST, e))
+                return
+            await self.send(self.READINGS_RESPONSE, {
+                SESSION_ID: data[SESSION_ID],
+                READINGS: readings,
+                NEXT_CURSOR: cursor
+            }, room=sid)
 
         @self.sio.on(self.DISCONNECT)
         def diconnect(sid):
@@ -205,10 +404,13 @@ if __name__ == '__main__':
     async def on_shutdown(app):
         print('{} >>>>> Server shutdown <<<<<'.format(datetime.now()))
         for sid in server.sockets:
-            await server.send(server.EVENT_SERVER_SHUTDOWN, {})
+            await server.send(server.EVENT_SERVER_SHUTDOWN, {}, room=sid)
             # await server.sio.disconnect(sid)
         print('{} >>>>> Shutting down db <<<<<'.format(datetime.now()))
+        server.db.flush_sessions()
         server.db.shutdown()
+        server.analyzer.shutdown()
+        server.reading_handler.shutdown()
     server.app.on_shutdown.append(on_shutdown)
 
     if args.port:
@@ -17,3 +17,51 @@ LOG_DIR = 'log'
 ###
 BOOL_CLF_DIR = 'classifiers/bool'
 TYPE_CLF_DIR = 'classifiers/type/iteration2'
+ANALYZER_EXECUTOR = 'thread' # 'thread', 'process' or '' for the event loop
+ANALYZER_WORKERS = 2
+ANALYZER_MAX_PENDING = 8 # Batches classified at once
+ANALYZER_BATCH_DELAY = 0.005 # Seconds a window waits to be batched with others
+ANALYZER_BATCH_SIZE = 32 # Windows predicted per classifier call at most
+MODEL_CACHE_BYTES = 512 * 1024 * 1024 # Pickle bytes of per-sport models kept loaded
+REANALYSIS_WORKERS = 4 # Processes stored sessions are re-analyzed in
+
+# Windows whose accelerometer magnitude variance ((m/s^2)^2) and peak
+# gyroscope rate (deg/sec) are both below their sport's thresholds skip the
+# bool classifier. Check skip rates at /analyzer-stats when tuning.
+PREFILTER_ENABLED = False
+PREFILTER_THRESHOLDS = {
+    'skating': (0.5, 90.0),
+    'volleyball': (1.0, 90.0),
+}
+
+
+###
+# Session buffer settings
+###
+BUFFER_CAPACITY = 3000 # Readings preallocated per sensor (~1 minute at 52 Hz)
+BUFFER_WINDOW = 150 # Latest readings per sensor kept in memory once flushed
+BULK_CHUNK_SIZE = 10000 # Readings written to the database per transaction
+FLUSH_INTERVAL = 30 # Seconds between writes of buffered readings
+FLUSH_ROWS = 1500 # Unwritten readings per sensor that trigger an early write
+
+
+###
+# Request settings
+###
+REQUEST_PAGE_SIZE = 20 # Sessions per request_data response at most
+READINGS_PAGE_SIZE = 5000 # Readings per request_readings response at most
+PLOT_MAX_POINTS = 10000 # Samples per channel /readings downsamples to at most
+EXPORT_CHUNK_SIZE = 50000 # Readings fetched and written at a time by exports
+EXPORT_WORKERS = 2 # Threads running /export downloads, apart from the database's
+
+
+###
+# Dataset settings
+###
+DATASET_CHUNK_SIZE = 1000 # Windows featurized and written at a time
+DATASET_WORKERS = 4 # Processes sessions are built in
+
+###
+# Database worker settings
+###
+DB_WORKERS = 4 # Threads running queries and commits off the event loop
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+from types import SimpleNamespace
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from tools.analyzer import Analyzer
+
+
+def to_readings(window):
+    # The Reading objects the original preprocessing took, with the values
+    # as Python floats
+    return [SimpleNamespace(
+        accelerometer=SimpleNamespace(x=float(r[0]), y=float(r[1]),
+                                      z=float(r[2])),
+        gyroscope=SimpleNamespace(x=float(r[3]), y=float(r[4]),
+                                  z=float(r[5])),
+        magnetometer=SimpleNamespace(x=float(r[6]), y=float(r[7]),
+                                     z=float(r[8])))
+        for r in window]
+
+
+class BaselineAnalyzer:
+    """The original list-based preprocess_bool/preprocess_type, verbatim
+    except that they return the feature row instead of a dataframe"""
+
+    AGGREGATE_AVERAGE = Analyzer.AGGREGATE_AVERAGE
+    AGGREGATE_MAX = Analyzer.AGGREGATE_MAX
+    AGGREGATE_MIN = Analyzer.AGGREGATE_MIN
+
+    def __init__(self, type_interval, type_agg_method):
+        self.type_interval = type_interval
+        self.type_agg_method = type_agg_method
+
+    def preprocess_bool(self, readings):
+        data = []
+        for reading in readings:
+            values = [
+                reading.accelerometer.x,
+                reading.accelerometer.y,
+                reading.accelerometer.z,
+                reading.gyroscope.x,
+                reading.gyroscope.y,
+                reading.gyroscope.z,
+                reading.magnetometer.x,
+                reading.magnetometer.y,
+                reading.magnetometer.z
+            ]
+            data.extend(values)
+        return data
+
+    def preprocess_type(self, readings):
+        half = len(readings)//2
+
+        # Reorganize list to make it easier to work with
+        # Resulting list order: [middle reading, middle->start, middle->end]
+        reorganized = [readings[half-1]]
+        reorganized.extend(readings[:half][::-1])
+        reorganized.extend(readings[half:])
+
+        data = [
+            reorganized[0].accelerometer.x,
+            reorganized[0].accelerometer.y,
+            reorganized[0].accelerometer.z,
+            reorganized[0].gyroscope.x,
+            reorganized[0].gyroscope.y,
+            reorganized[0].gyroscope.z,
+            reorganized[0].magnetometer.x,
+            reorganized[0].magnetometer.y,
+            reorganized[0].magnetometer.z
+        ]
+        # Step through, aggregating reading intervals after first
+        for i in range(1, len(reorganized), self.type_interval):
+            agg = self.aggregate_readings(reorganized[i:i+self.type_interval])
+            data.extend([
+                agg['accelerometer']['x'],
+                agg['accelerometer']['y'],
+                agg['accelerometer']['z'],
+                agg['gyroscope']['x'],
+                agg['gyroscope']['y'],
+                agg['gyroscope']['z'],
+                agg['magnetometer']['x'],
+                agg['magnetometer']['y'],
+                agg['magnetometer']['z']
+            ])
+        return data
+
+    def aggregate_readings(self, readings):
+        data = []
+        for reading in readings:
+            data.append([
+                reading.accelerometer.x,
+                reading.accelerometer.y,
+                reading.accelerometer.z,
+                reading.gyroscope.x,
+                reading.gyroscope.y,
+                reading.gyroscope.z,
+                reading.magnetometer.x,
+                reading.magnetometer.y,
+                reading.magnetometer.z
+            ])
+
+        if self.type_agg_method == self.AGGREGATE_MAX:
+            aggregated = np.max(data, axis=0)
+        elif self.type_agg_method == self.AGGREGATE_MIN:
+            aggregated = np.min(data, axis=0)
+        else:
+            aggregated = np.mean(data, axis=0)
+
+        return {
+            'accelerometer': {
+                'x': aggregated[0],
+                'y': aggregated[1],
+                'z': aggregated[2]
+            },
+            'gyroscope': {
+                'x': aggregated[3],
+                'y': aggregated[4],
+                'z': aggregated[5]
+            },
+            'magnetometer': {
+                'x': aggregated[6],
+                'y': aggregated[7],
+                'z': aggregated[8]
+            }
+        }
+
+
+class FeaturizeTest(unittest.TestCase):
+    METHODS = [Analyzer.AGGREGATE_AVERAGE, Analyzer.AGGREGATE_MAX,
+               Analyzer.AGGREGATE_MIN]
+    INTERVALS = [1, 2, 3, 5, 7, 12]
+    WINDOW_SIZES = [149, 150]
+
+    def setUp(self):
+        self.random = np.random.RandomState(9)
+
+    def analyzer(self, method, interval, window_size):
+        with mock.patch.object(Analyzer, 'get_params',
+                               return_value=[method]):
+            return Analyzer(type_window_size=window_size,
+                            type_sample_interval=interval, executor='')
+
+    def windows(self, count, size):
+        # Readings arrive (in frames) and are buffered as float32
+        return self.random.normal(
+            scale=50, size=(count, size, 9)).astype(np.float32)
+
+    def assert_features_equal(self, features, expected):
+        self.assertEqual(features.dtype, np.float64)
+        np.testing.assert_array_equal(features, np.array(expected))
+
+    def test_type_matches_baseline(self):
+        for method in self.METHODS:
+            for interval in self.INTERVALS:
+                for size in self.WINDOW_SIZES:
+                    with self.subTest(method=method, interval=interval,
+                                      size=size):
+                        analyzer = self.analyzer(method, interval, size)
+                        baseline = BaselineAnalyzer(interval, method)
+                        window = self.windows(1, size)[0]
+                        self.assert_features_equal(
+                            analyzer.featurize_type(window),
+                            baseline.preprocess_type(to_readings(window)))
+
+    def test_type_stack_matches_baseline(self):
+        for method in self.METHODS:
+            for size in self.WINDOW_SIZES:
+                with self.subTest(method=method, size=size):
+                    analyzer = self.analyzer(method, 5, size)
+                    baseline = BaselineAnalyzer(5, method)
+                    windows = self.windows(4, size)
+                    self.assert_features_equal(
+                        analyzer.featurize_type(windows),
+                        [baseline.preprocess_type(to_readings(window))
+                         for window in windows])
+
+    def test_bool_matches_baseline(self):
+        analyzer = self.analyzer(Analyzer.AGGREGATE_AVERAGE, 5, 150)
+        baseline = BaselineAnalyzer(5, Analyzer.AGGREGATE_AVERAGE)
+        windows = self.windows(4, 150)
+        self.assert_features_equal(
+            analyzer.featurize_bool(windows),
+            [baseline.preprocess_bool(to_readings(window))
+             for window in windows])
+
+
+if __name__ == '__main__':
+    unittest.main()
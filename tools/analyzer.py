@@ -1,16 +1,147 @@
 #!/usr/bin/env python3
 
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+import os
 import pickle
+import time
 import pandas as pd
 import numpy as np
 from random import randint
 from sklearn.ensemble import RandomForestClassifier
 
+from settings import (ANALYZER_BATCH_DELAY, ANALYZER_BATCH_SIZE,
+                      ANALYZER_EXECUTOR, ANALYZER_MAX_PENDING,
+                      ANALYZER_WORKERS, MODEL_CACHE_BYTES, PREFILTER_ENABLED,
+                      PREFILTER_THRESHOLDS)
 from tools.errors import AnalyzerError
 
 JUMP_TYPES = [
     "none", "axel", "toe", "flip", "lutz", "loop", "sal", "half-loop", "waltz"]
 
+# Classifiers unpickled by process pool workers, keyed by (file, mtime),
+# least recently used first
+_worker_clfs = OrderedDict()
+# Featurizes the windows in each process pool worker, set by _init_worker
+_worker_analyzer = None
+
+
+def _predict_windows(preprocess, clf, windows):
+    # Thread pool job: preprocess a batch of windows and predict them at once
+    return clf.predict(preprocess(np.stack(windows)))
+
+
+def _init_worker(type_interval, type_agg_method):
+    global _worker_analyzer
+    _worker_analyzer = Analyzer(type_sample_interval=type_interval,
+                                type_agg_method=type_agg_method,
+                                executor='', prefilter=False)
+
+
+def _predict_file(clf_key, preprocess, windows):
+    # Process pool job: preprocess a batch of windows (preprocess being the
+    # name of the Analyzer method) and predict them at once. Classifiers are
+    # loaded once per worker from file.
+    if clf_key in _worker_clfs:
+        _worker_clfs.move_to_end(clf_key)
+        clf = _worker_clfs[clf_key][0]
+    else:
+        with open(clf_key[0], 'rb') as f:
+            clf = pickle.load(f)
+        _worker_clfs[clf_key] = (clf, os.path.getsize(clf_key[0]))
+        # Same footprint bound as the server's ModelRegistry
+        total = sum(size for _, size in _worker_clfs.values())
+        while total > MODEL_CACHE_BYTES and len(_worker_clfs) > 1:
+            total -= _worker_clfs.popitem(last=False)[1][1]
+    return clf.predict(
+        getattr(_worker_analyzer, preprocess)(np.stack(windows)))
+
+
+class InferenceScheduler:
+    """
+    Gathers windows waiting on the same classifier, from every session, and
+    predicts them with one call on the stacked features.
+
+    A batch is predicted once it holds max_batch windows or max_delay
+    seconds after its first window arrived, whichever comes first.
+
+    ...
+
+    Attributes
+    ----------
+    analyzer : Analyzer
+        Analyzer whose executor runs the predictions
+    max_delay : float
+        Seconds a window can wait for others to join its batch
+    max_batch : int
+        # windows predicted together at most
+
+    Methods
+    -------
+    predict(preprocess:function, clf:classifier, clf_key:tuple,
+            readings:np.ndarray)
+        Queues a window and returns its predictions once its batch ran
+    """
+
+    def __init__(self, analyzer, max_delay=ANALYZER_BATCH_DELAY,
+                 max_batch=ANALYZER_BATCH_SIZE):
+        """
+        Parameters
+        ----------
+        analyzer : Analyzer
+            Analyzer whose executor runs the predictions
+        max_delay : float, optional
+            Seconds a window can wait for others to join its batch
+        max_batch : int, optional
+            # windows predicted together at most
+        """
+
+        self.analyzer = analyzer
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        # Windows waiting per classifier: key -> (preprocess, clf, [(readings, future)])
+        self._batches = {}
+        self._timers = {}
+
+    async def predict(self, preprocess, clf, clf_key, readings):
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        if clf_key not in self._batches:
+            self._batches[clf_key] = (preprocess, clf, [])
+        batch = self._batches[clf_key][2]
+        batch.append((readings, future))
+
+        if len(batch) >= self.max_batch:
+            self._flush(clf_key)
+        elif clf_key not in self._timers:
+            self._timers[clf_key] = loop.call_later(
+                self.max_delay, self._flush, clf_key)
+        return await future
+
+    def _flush(self, clf_key):
+        timer = self._timers.pop(clf_key, None)
+        if timer is not None:
+            timer.cancel()
+        preprocess, clf, batch = self._batches.pop(clf_key)
+        asyncio.ensure_future(self._run(preprocess, clf, clf_key, batch))
+
+    async def _run(self, preprocess, clf, clf_key, batch):
+        windows = [readings for readings, _ in batch]
+        try:
+            predictions = await self.analyzer.predict_windows(
+                preprocess, clf, clf_key, windows)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for i, (_, future) in enumerate(batch):
+            if not future.done():
+                future.set_result(predictions[i:i + 1])
+
 
 class Analyzer:
     """
@@ -31,6 +162,18 @@ class Analyzer:
         analyzes data for the occurrence of an event
     type_clf : type classifier 
         analyzes data for the type of an event
+    executor : concurrent.futures.Executor
+        Pool classification runs in, None to run on the event loop
+    scheduler : InferenceScheduler
+        Batches windows from all sessions into shared predict calls
+    prefilter_thresholds : dict<str, tuple(float, float)>
+        Per sport (accelerometer magnitude variance, peak gyroscope rate)
+        below which a window is not sent to the bool classifier. Empty when
+        the prefilter is disabled.
+    prefilter_counts : dict<str, list[int, int]>
+        Per sport [windows checked, windows skipped] by the prefilter
+    registry : ModelRegistry
+        Per-sport classifiers, used before the defaults when set
     window_size : int
         # rows to be sent to classifiers
     sample_interval : int
@@ -42,22 +185,62 @@ class Analyzer:
         Loads boolean classifier from pickle path. Resets window.
     load_type(clf_file:str)
         Loads type classifier from pickle path. Resets window.
+    read_clf(kind:str, clf_file:str)
+        Unpickles a classifier and warms it up with a dummy prediction.
+        Returns (classifier, load seconds, warm-up seconds).
+    swap_bool(clf_file:str, dest:str optional)
+        Coroutine, loads a bool classifier off the event loop, warms it up,
+        optionally moves its file to dest and swaps it in. Returns timings.
+    swap_type(clf_file:str, dest:str optional)
+        Coroutine, same as swap_bool for the type classifier
+    get_clf(kind:str, sport:str optional)
+        Coroutine, returns (classifier, key) for the sport's windows: its
+        model in the registry, or the default classifier
+    get_bool_clf_name(sport:str optional)
+        Returns the name of the bool classifier used for the sport
+    get_type_clf_name(sport:str optional)
+        Returns the name of the type classifier used for the sport
     bool_can_analyze(reading_count:int)
         Checks current reading count against bool window size/interval to
         determine if new analysis is possible.
-    bool_can_analyze(reading_count:int)
+    type_can_analyze(reading_count:int)
         Checks current reading count against type window size/interval to
         determine if new analysis is possible.
-    preprocess_bool(readings:list[Reading])
-        Formats a list of Readings into useable state for bool classifier.
-    preprocess_type(readings:list[Reading])
-        Formats a list of Readings into useable state for type classifier.
-    is_event(readings:list[Reading])
-        Runs bool preprocessor/classifier on Reading window.
+    bool_analysis_points(previous:int, count:int)
+        Returns the reading counts in (previous, count] that start a new
+        bool analysis.
+    get_bool_header(size:int)
+        Returns the bool classifier's column names for a window size
+    get_type_header(size:int)
+        Returns the type classifier's column names for a window size
+    featurize_bool(readings:np.ndarray)
+        Returns the bool classifier's feature row(s) for a (window, 9)
+        reading array or a stack of them
+    featurize_type(readings:np.ndarray)
+        Returns the type classifier's feature row(s) for a (window, 9)
+        reading array or a stack of them
+    preprocess_bool(readings:np.ndarray)
+        Formats a (window, 9) reading array into useable state for bool
+        classifier.
+    preprocess_type(readings:np.ndarray)
+        Formats a (window, 9) reading array into useable state for type
+        classifier.
+    is_quiet(readings:np.ndarray, sport:str)
+        True if the window's signal energy is below the sport's prefilter
+        thresholds
+    get_prefilter_stats()
+        Returns per sport prefilter window/skip counts and skip rate
+    is_event(readings:np.ndarray, sport:str optional)
+        Runs prefilter, then bool preprocessor/classifier on reading window.
         True if an event is found.
-    predict_event_type(readings:list[Reading])
-        Runs type preprocessor/classifier on Reading window.
+    predict_event_type(readings:np.ndarray, sport:str optional)
+        Runs type preprocessor/classifier on reading window.
         Returns an event type name.
+    predict_windows(preprocess:function, clf:classifier, clf_key:tuple,
+                    windows:list[np.ndarray])
+        Preprocesses windows and predicts them with one call in the executor
+    shutdown()
+        Shuts down the executor
     """
 
     BOOL_PARAMS_FILE = 'analyzer/skater/jump_count_params.txt'
@@ -67,10 +250,22 @@ class Analyzer:
     AGGREGATE_MAX = 'max'
     AGGREGATE_MIN = 'min'
 
+    BOOL = 'bool'
+    TYPE = 'type'
+
+    EXECUTOR_THREAD = 'thread'
+    EXECUTOR_PROCESS = 'process'
 
     def __init__(self, pickled_bool_clf=None, pickled_type_clf=None,
                  bool_window_size=150, bool_sample_interval=75,
-                 type_window_size=150, type_sample_interval=5):
+                 type_window_size=150, type_sample_interval=5,
+                 type_agg_method=None,
+                 executor=ANALYZER_EXECUTOR, workers=ANALYZER_WORKERS,
+                 max_pending=ANALYZER_MAX_PENDING,
+                 batch_delay=ANALYZER_BATCH_DELAY,
+                 batch_size=ANALYZER_BATCH_SIZE,
+                 prefilter=PREFILTER_ENABLED,
+                 prefilter_thresholds=PREFILTER_THRESHOLDS):
         """
         Parameters
         ----------
@@ -88,16 +283,64 @@ class Analyzer:
         type_sample_interval : int, optional
             Interval size for readings to be aggregated together for type
             classifier's predictions
+        type_agg_method : str, optional
+            How the type classifier's intervals are aggregated, read from
+            the type params file by default
+        executor : str, optional
+            'thread' to preprocess and predict in a thread pool, 'process'
+            to predict in a process pool, '' to run on the event loop
+        workers : int, optional
+            # threads/processes in the pool
+        max_pending : int, optional
+            # batches that can be classified at once, others wait their turn
+        batch_delay : float, optional
+            Seconds a window waits for windows from other sessions to be
+            predicted with
+        batch_size : int, optional
+            # windows predicted with one call at most
+        prefilter : bool, optional
+            Skip the bool classifier for windows with too little motion
+        prefilter_thresholds : dict<str, tuple(float, float)>, optional
+            Per sport (accelerometer magnitude variance, peak gyroscope rate)
+            thresholds for the prefilter
         """
 
         self.bool_clf = None
         self.type_clf = None
+        self.bool_clf_key = None
+        self.type_clf_key = None
         self.bool_window_size = bool_window_size
         self.bool_interval = bool_sample_interval
         self.type_window_size = type_window_size
         self.type_interval = type_sample_interval
-        type_params = self.get_params(self.TYPE_PARAMS_FILE)
-        self.type_agg_method = type_params[-1]
+        if type_agg_method is None:
+            type_params = self.get_params(self.TYPE_PARAMS_FILE)
+            type_agg_method = type_params[-1]
+        self.type_agg_method = type_agg_method
+        self.executor_type = executor
+        if executor == self.EXECUTOR_THREAD:
+            self.executor = ThreadPoolExecutor(max_workers=workers)
+        elif executor == self.EXECUTOR_PROCESS:
+            # Spawned rather than forked: a fork copies the locks other
+            # threads (database pool, executors) hold at that moment.
+            # Workers featurize with this analyzer's aggregation.
+            self.executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(self.type_interval, self.type_agg_method))
+        else:
+            self.executor = None
+        self.max_pending = max_pending
+        # Created on first use so it belongs to the server's event loop
+        self._pending = None
+        self.scheduler = InferenceScheduler(
+            self, max_delay=batch_delay, max_batch=batch_size)
+        self.prefilter_thresholds = prefilter_thresholds if prefilter else {}
+        self.prefilter_counts = {}
+        self.registry = None
+        # Classifier column names, keyed by (classifier, window size)
+        self._headers = {}
         if pickled_bool_clf is not None:
             self.load_bool(pickled_bool_clf)
         if pickled_type_clf is not None:
@@ -117,9 +360,9 @@ class Analyzer:
             path to pickled boolean classifier
         """
 
-        with open(clf_file, 'rb') as f:
-            self.bool_clf = pickle.load(f)
-            f.close()
+        clf = self.read_clf(self.BOOL, clf_file)[0]
+        self.bool_clf, self.bool_clf_key = \
+            clf, (clf_file, os.path.getmtime(clf_file))
     
     def load_type(self, clf_file):
         """
@@ -129,16 +372,126 @@ class Analyzer:
             path to pickled type classifier
         """
 
+        clf = self.read_clf(self.TYPE, clf_file)[0]
+        self.type_clf, self.type_clf_key = \
+            clf, (clf_file, os.path.getmtime(clf_file))
+
+    def read_clf(self, kind, clf_file):
+        """
+        Unpickles a classifier and warms it up with a prediction on an
+        all-zero window, so the first real window does not pay for lazy
+        initialization and a classifier that cannot predict the analyzer's
+        features is rejected. Returns (classifier, seconds to unpickle,
+        seconds to warm up).
+
+        Parameters
+        ----------
+        kind : str
+            BOOL or TYPE
+        clf_file : str
+            path to pickled classifier
+        """
+
+        start = time.perf_counter()
         with open(clf_file, 'rb') as f:
-            self.type_clf = pickle.load(f)
-            f.close()
+            clf = pickle.load(f)
+        loaded = time.perf_counter()
+        preprocess, window = self._warm_up_window(kind)
+        clf.predict(preprocess(window))
+        return clf, loaded - start, time.perf_counter() - loaded
+
+    def _warm_up_window(self, kind):
+        # (preprocess, all-zero window) of the classifier kind
+        if kind == self.BOOL:
+            return self.preprocess_bool, np.zeros(
+                (self.bool_window_size, 9), dtype=np.float32)
+        return self.preprocess_type, np.zeros(
+            (self.type_window_size, 9), dtype=np.float32)
+
+    async def swap_bool(self, clf_file, dest=None):
+        return await self._swap(self.BOOL, clf_file, dest)
+
+    async def swap_type(self, clf_file, dest=None):
+        return await self._swap(self.TYPE, clf_file, dest)
+
+    async def _swap(self, kind, clf_file, dest):
+        """
+        Loads and warms up a classifier in a thread, then swaps it in with
+        one assignment. Windows already queued keep the classifier they
+        were queued with, so in-flight predictions finish on the old model.
+        Returns the timings in seconds.
 
-    def get_bool_clf_name(self):
+        Parameters
+        ----------
+        kind : str
+            BOOL or TYPE
+        clf_file : str
+            path to pickled classifier
+        dest : str, optional
+            path the file is moved to once it loaded and predicted
+        """
+
+        start = time.perf_counter()
+        loop = asyncio.get_event_loop()
+        clf, loaded, warmed = await loop.run_in_executor(
+            None, self.read_clf, kind, clf_file)
+        if dest is not None:
+            os.replace(clf_file, dest)
+            clf_file = dest
+        clf_key = (clf_file, os.path.getmtime(clf_file))
+        if self.executor_type == self.EXECUTOR_PROCESS:
+            # Workers unpickle from the file on first use, warm one up
+            preprocess, window = self._warm_up_window(kind)
+            await loop.run_in_executor(
+                self.executor, _predict_file, clf_key, preprocess.__name__,
+                [window])
+
+        if kind == self.BOOL:
+            self.bool_clf, self.bool_clf_key = clf, clf_key
+        else:
+            self.type_clf, self.type_clf_key = clf, clf_key
+        return {
+            'load': loaded,
+            'warm_up': warmed,
+            'total': time.perf_counter() - start
+        }
+
+    async def get_clf(self, kind, sport=None):
+        """
+        Returns (classifier, key) of the sport's model from the registry,
+        or of the default classifier if the sport has none. Coroutine, as
+        the sport's model may need to be loaded first.
+
+        Parameters
+        ----------
+        kind : str
+            BOOL or TYPE
+        sport : str, optional
+            Name of the session's sport
+        """
+
+        if self.registry is not None and sport is not None:
+            model = await self.registry.get(kind, sport)
+            if model is not None:
+                return model
+        if kind == self.BOOL:
+            return self.bool_clf, self.bool_clf_key
+        return self.type_clf, self.type_clf_key
+
+    def get_bool_clf_name(self, sport=None):
+        if self.registry is not None and sport is not None:
+            name = self.registry.get_name(self.BOOL, sport)
+            if name is not None:
+                return name
         if self.bool_clf is None:
             return 'No classifier set'
         return self.bool_clf.__class__.__name__
 
-    def get_type_clf_name(self):
+    def get_type_clf_name(self, sport=None):
+        if self.registry is not None and sport is not None:
+            name = self.registry.get_name(self.TYPE, sport)
+            if name is not None:
+                return name
         if self.type_clf is None:
             return 'No classifier set'
         return self.type_clf.__class__.__name__
@@ -170,9 +523,134 @@ class Analyzer:
 
         return reading_count >= self.type_window_size
 
+    def bool_analysis_points(self, previous, count):
+        """
+        Returns every reading count after previous, up to and including
+        count, where bool_can_analyze is True. Used when a batch of readings
+        crosses several window boundaries at once.
+
+        Parameters
+        ----------
+        previous : int
+            # readings before the batch was added
+        count : int
+            # readings after the batch was added
+        """
+
+        first = max(previous + 1, self.bool_window_size)
+        first += -first % self.bool_interval
+        return list(range(first, count + 1, self.bool_interval))
+
+    def get_bool_header(self, size):
+        """
+        Returns the bool classifier's column names for a window of size
+        readings. Computed once per window size.
+        """
+
+        key = (self.BOOL, size)
+        if key not in self._headers:
+            header = []
+            for count in range(size):
+                header.extend([
+                    f'Accelerometer-X-{count}', f'Accelerometer-Y-{count}', f'Accelerometer-Z-{count}',
+                    f'Gyroscope-X-{count}', f'Gyroscope-Y-{count}', f'Gyroscope-Z-{count}',
+                    f'Magnetometer-X-{count}', f'Magnetometer-Y-{count}', f'Magnetometer-Z-{count}'])
+            self._headers[key] = header
+        return self._headers[key]
+
+    def get_type_header(self, size):
+        """
+        Returns the type classifier's column names for a window of size
+        readings. Computed once per window size.
+        """
+
+        key = (self.TYPE, size)
+        if key not in self._headers:
+            header = ['Accelerometer-X', 'Accelerometer-Y', 'Accelerometer-Z',
+                      'Gyroscope-X', 'Gyroscope-Y', 'Gyroscope-Z',
+                      'Magnetometer-X', 'Magnetometer-Y', 'Magnetometer-Z']
+            # Insert past half of aggregated headers, working backwords
+            # E.g. Accelerometer-X|Y|Z-past-5, 10, 15...
+            # Followed by future half of aggregated headers, working forwards
+            half = size//2
+            past = []
+            future = []
+            for i in range(1, half, self.type_interval):
+                past.extend([
+                    f'Accelerometer-X-past-{i}',
+                    f'Accelerometer-Y-past-{i}',
+                    f'Acceleromter-Z-past-{i}',
+                    f'Gyroscope-X-past-{i}',
+                    f'Gyroscope-Y-past-{i}',
+                    f'Gyroscope-Z-past-{i}',
+                    f'Magnetometer-X-past-{i}',
+                    f'Magnetometer-Y-past-{i}',
+                    f'Magnetometer-Z-past-{i}'])
+                future.extend([
+                    f'Accelerometer-X-future-{i}',
+                    f'Accelerometer-Y-future-{i}',
+                    f'Acceleromter-Z-future-{i}',
+                    f'Gyroscope-X-future-{i}',
+                    f'Gyroscope-Y-future-{i}',
+                    f'Gyroscope-Z-future-{i}',
+                    f'Magnetometer-X-future-{i}',
+                    f'Magnetometer-Y-future-{i}',
+                    f'Magnetometer-Z-future-{i}'])
+            header.extend(past)
+            header.extend(future)
+            self._headers[key] = header
+        return self._headers[key]
+
+    def featurize_bool(self, readings):
+        """
+        Flattens a window of readings into the bool classifier's feature
+        row: every reading's nine values, oldest reading first.
+
+        Parameters
+        ----------
+        readings : np.ndarray
+            (window, 9) array of accelerometer, gyroscope and magnetometer
+            x/y/z values, or a (windows, window, 9) stack of them
+        """
+
+        # Features are float64, as the readings' values are (frames and the
+        # database hold float32, which widens exactly)
+        readings = np.asarray(readings, dtype=np.float64)
+        return readings.reshape(readings.shape[:-2] + (-1,))
+
+    def featurize_type(self, readings):
+        """
+        Builds the type classifier's feature row from a window of readings:
+        the middle reading, followed by the readings before it (going back)
+        and the readings after it (going forward), aggregated in chunks of
+        type_interval readings.
+
+        Parameters
+        ----------
+        readings : np.ndarray
+            (window, 9) array of accelerometer, gyroscope and magnetometer
+            x/y/z values, or a (windows, window, 9) stack of them
+        """
+
+        # Aggregated in float64, as the readings' values are
+        readings = np.asarray(readings, dtype=np.float64)
+
+        # Reorganize window to make it easier to work with
+        # Resulting order: [middle reading, middle->start, middle->end]
+        half = readings.shape[-2]//2
+        reorganized = np.concatenate([
+            readings[..., half-1:half, :],
+            readings[..., :half, :][..., ::-1, :],
+            readings[..., half:, :]], axis=-2)
+
+        aggregated = self.aggregate_readings(reorganized[..., 1:, :])
+        return np.concatenate([
+            reorganized[..., 0, :],
+            aggregated.reshape(aggregated.shape[:-2] + (-1,))], axis=-1)
+
     def preprocess_bool(self, readings):
         """
-        Formats a list of readings into a dataframe useable by the
+        Formats a window of readings into a dataframe useable by the
         bool classifier.
 
         All readings in a window are collapsed into a 1-row dataframe
@@ -190,36 +668,19 @@ class Analyzer:
 
         Parameters
         ----------
-        readings : list[Reading]
-            List of Readings to be formatted
-        """
-
-        data = []
-        header = []
-        count = 0
-        for reading in readings:
-            header.extend([
-                f'Accelerometer-X-{count}', f'Accelerometer-Y-{count}', f'Accelerometer-Z-{count}',
-                f'Gyroscope-X-{count}', f'Gyroscope-Y-{count}', f'Gyroscope-Z-{count}',
-                f'Magnetometer-X-{count}', f'Magnetometer-Y-{count}', f'Magnetometer-Z-{count}'])
-            values = [
-                reading.accelerometer.x,
-                reading.accelerometer.y,
-                reading.accelerometer.z,
-                reading.gyroscope.x,
-                reading.gyroscope.y,
-                reading.gyroscope.z,
-                reading.magnetometer.x,
-                reading.magnetometer.y,
-                reading.magnetometer.z
-            ]
-            data.extend(values)
-            count += 1
-        return pd.DataFrame([data], columns=header)
+        readings : np.ndarray
+            (window, 9) array of accelerometer, gyroscope and magnetometer
+            x/y/z values, oldest reading first. A (windows, window, 9) stack
+            gives one row per window.
+        """
+
+        return pd.DataFrame(
+            np.atleast_2d(self.featurize_bool(readings)),
+            columns=self.get_bool_header(readings.shape[-2]))
 
     def preprocess_type(self, readings):
         """
-        Formats a list of readings into a dataframe useable by the
+        Formats a window of readings into a dataframe useable by the
         type classifier.
 
         All readings in a window are collapsed into a 1-row dataframe
@@ -242,137 +703,110 @@ class Analyzer:
 
         Parameters
         ----------
-        readings : list[Reading]
-            List of Readings to be formatted
-        """
-
-        header = ['Accelerometer-X', 'Accelerometer-Y', 'Accelerometer-Z',
-                  'Gyroscope-X', 'Gyroscope-Y', 'Gyroscope-Z',
-                  'Magnetometer-X', 'Magnetometer-Y', 'Magnetometer-Z']
-        # Insert past half of aggregated headers, working backwords
-        # E.g. Accelerometer-X|Y|Z-past-5, 10, 15...
-        # Followed by future half of aggregated headers, working forwards
-        half = len(readings)//2
-        past = []
-        future = []
-        for i in range(1, half, self.type_interval):
-            past.extend([
-                f'Accelerometer-X-past-{i}',
-                f'Accelerometer-Y-past-{i}',
-                f'Acceleromter-Z-past-{i}',
-                f'Gyroscope-X-past-{i}',
-                f'Gyroscope-Y-past-{i}',
-                f'Gyroscope-Z-past-{i}',
-                f'Magnetometer-X-past-{i}',
-                f'Magnetometer-Y-past-{i}',
-                f'Magnetometer-Z-past-{i}'])
-            future.extend([
-                f'Accelerometer-X-future-{i}',
-                f'Accelerometer-Y-future-{i}',
-                f'Acceleromter-Z-future-{i}',
-                f'Gyroscope-X-future-{i}',
-                f'Gyroscope-Y-future-{i}',
-                f'Gyroscope-Z-future-{i}',
-                f'Magnetometer-X-future-{i}',
-                f'Magnetometer-Y-future-{i}',
-                f'Magnetometer-Z-future-{i}'])
-        header.extend(past)
-        header.extend(future)
-
-        # Reorganize list to make it easier to work with
-        # Resulting list order: [middle reading, middle->start, middle->end]
-        reorganized = [readings[half-1]]
-        reorganized.extend(readings[:half][::-1])
-        reorganized.extend(readings[half:])
-
-        data = [
-            reorganized[0].accelerometer.x,
-            reorganized[0].accelerometer.y,
-            reorganized[0].accelerometer.z,
-            reorganized[0].gyroscope.x,
-            reorganized[0].gyroscope.y,
-            reorganized[0].gyroscope.z,
-            reorganized[0].magnetometer.x,
-            reorganized[0].magnetometer.y,
-            reorganized[0].magnetometer.z
-        ]
-        # Step through, aggregating reading intervals after first
-        for i in range(1, len(reorganized), self.type_interval):
-            agg = self.aggregate_readings(reorganized[i:i+self.type_interval])
-            data.extend([
-                agg['accelerometer']['x'],
-                agg['accelerometer']['y'],
-                agg['accelerometer']['z'],
-                agg['gyroscope']['x'],
-                agg['gyroscope']['y'],
-                agg['gyroscope']['z'],
-                agg['magnetometer']['x'],
-                agg['magnetometer']['y'],
-                agg['magnetometer']['z']
-            ])
-
-
-        return pd.DataFrame([data], columns=header)
+        readings : np.ndarray
+            (window, 9) array of accelerometer, gyroscope and magnetometer
+            x/y/z values, oldest reading first. A (windows, window, 9) stack
+            gives one row per window.
+        """
+
+        return pd.DataFrame(
+            np.atleast_2d(self.featurize_type(readings)),
+            columns=self.get_type_header(readings.shape[-2]))
 
     def aggregate_readings(self, readings):
         """
-        Aggregates readings based on the method specified.
-        Methods include mean, max, or min values. 
-        """
+        Aggregates consecutive chunks of type_interval readings based on the
+        method specified. Methods include mean, max, or min values.
 
-        data = []
-        for reading in readings:
-            data.append([
-                reading.accelerometer.x,
-                reading.accelerometer.y,
-                reading.accelerometer.z,
-                reading.gyroscope.x,
-                reading.gyroscope.y,
-                reading.gyroscope.z,
-                reading.magnetometer.x,
-                reading.magnetometer.y,
-                reading.magnetometer.z
-            ])
+        Whole chunks are reduced in one call on a (chunks, interval, 9) view
+        of the readings; a shorter last chunk is reduced on its own.
+        Returns a (chunks, 9) float64 array (with any leading stack
+        dimensions kept).
+
+        Parameters
+        ----------
+        readings : np.ndarray
+            (count, 9) array of readings, or a stack of them
+        """
 
         if self.type_agg_method == self.AGGREGATE_MAX:
-            aggregated = np.max(data, axis=0)
+            aggregate = np.max
         elif self.type_agg_method == self.AGGREGATE_MIN:
-            aggregated = np.min(data, axis=0)
+            aggregate = np.min
         else:
-            aggregated = np.mean(data, axis=0)
-        
-        return {
-            'accelerometer': {
-                'x': aggregated[0],
-                'y': aggregated[1],
-                'z': aggregated[2]
-            },
-            'gyroscope': {
-                'x': aggregated[3],
-                'y': aggregated[4],
-                'z': aggregated[5]
-            },
-            'magnetometer': {
-                'x': aggregated[6],
-                'y': aggregated[7],
-                'z': aggregated[8]
+            aggregate = np.mean
+
+        readings = np.asarray(readings, dtype=np.float64)
+        count = readings.shape[-2]
+        whole = count - count % self.type_interval
+        chunks = readings[..., :whole, :].reshape(
+            readings.shape[:-2] + (-1, self.type_interval, readings.shape[-1]))
+        aggregated = aggregate(chunks, axis=-2)
+        if whole < count:
+            rest = aggregate(readings[..., whole:, :], axis=-2, keepdims=True)
+            aggregated = np.concatenate([aggregated, rest], axis=-2)
+        return aggregated
+
+    def is_quiet(self, readings, sport):
+        """
+        Checks whether a window clearly holds no event: the variance of the
+        accelerometer magnitude and the peak gyroscope rate are both below
+        the sport's thresholds. Sports without thresholds are never quiet.
+        Counts checked and skipped windows per sport.
+
+        Parameters
+        ----------
+        readings : np.ndarray
+            (window, 9) array of readings to be checked
+        sport : str
+            Name of the session's sport
+        """
+
+        if sport not in self.prefilter_thresholds:
+            return False
+
+        max_accel_variance, max_gyro_rate = self.prefilter_thresholds[sport]
+        accel = np.linalg.norm(readings[:, 0:3], axis=1)
+        gyro = np.linalg.norm(readings[:, 3:6], axis=1)
+        quiet = accel.var() < max_accel_variance and \
+            gyro.max() < max_gyro_rate
+
+        counts = self.prefilter_counts.setdefault(sport, [0, 0])
+        counts[0] += 1
+        if quiet:
+            counts[1] += 1
+        return quiet
+
+    def get_prefilter_stats(self):
+        stats = {}
+        for sport, (windows, skipped) in self.prefilter_counts.items():
+            stats[sport] = {
+                'windows': windows,
+                'skipped': skipped,
+                'skip_rate': skipped / windows if windows > 0 else 0.0
             }
-        }
+        return stats
 
-    async def is_event(self, readings):
+    async def is_event(self, readings, sport=None):
         """
         Runs boolean classifier on readings to look for an event occurrence
         If no boolean classifier is in use, randomly guess whether an event occurred
+        Windows the prefilter finds quiet are not classified.
         
         Parameters
         ----------
-        readings : list[Reading]
-            List of Readings in the window to be analyzed
+        readings : np.ndarray
+            (window, 9) array of readings to be analyzed
+        sport : str, optional
+            Name of the session's sport, selects the prefilter thresholds
+            and the classifier
         """
 
-        preprocessed = self.preprocess_bool(readings)
+        if self.is_quiet(readings, sport):
+            return False
 
-        if self.bool_clf is None:
+        clf, clf_key = await self.get_clf(self.BOOL, sport)
+        if clf is None:
             print('Still running fake classifier...')
             # TODO: Use real analyzer
             # Placeholder analysis that randomly selects an event or not
@@ -383,35 +817,68 @@ class Analyzer:
             # raise AnalyzerError(
             #     'Event bool classifier not setup, unable to analyze data')
 
-        predictions = self.bool_clf.predict(preprocessed)
+        predictions = await self._classify(
+            self.preprocess_bool, clf, clf_key, readings)
         for prediction in predictions:
             if prediction > 0:
                 return True
 
         return False
     
-    async def predict_event_type(self, readings):
+    async def predict_event_type(self, readings, sport=None):
         """
         Run type classifier on readings to look for an event occurrences
         If no type classifier is in use, always guess event type was Lutz
         
         Parameters
         ----------
-        readings : list[Reading]
-            List of Readings in the window to be analyzed
+        readings : np.ndarray
+            (window, 9) array of readings to be analyzed
+        sport : str, optional
+            Name of the session's sport, selects the classifier
         """
 
-        if self.type_clf is None:
+        clf, clf_key = await self.get_clf(self.TYPE, sport)
+        if clf is None:
              # TODO: Use real analyzer
             # Placeholder analysis that always returns a Lutz jump
             return ['Lutz']
 
             # raise AnalyzerError(
             #     'Event type classifier is not setup, unable to analyze data')
-        preprocessed = self.preprocess_type(readings)
-        predictions = self.type_clf.predict(preprocessed)
+        predictions = await self._classify(
+            self.preprocess_type, clf, clf_key, readings)
         return JUMP_TYPES[int(predictions[0])]
 
+    async def _classify(self, preprocess, clf, clf_key, readings):
+        return await self.scheduler.predict(preprocess, clf, clf_key, readings)
+
+    async def predict_windows(self, preprocess, clf, clf_key, windows):
+        """
+        Preprocesses the windows and predicts them with one call in the
+        executor, at most max_pending batches at a time. The process pool
+        receives the raw windows and featurizes them in the worker; workers
+        unpickle the classifier from its file the first time they see it.
+        """
+
+        if self.executor is None:
+            return _predict_windows(preprocess, clf, windows)
+
+        if self._pending is None:
+            self._pending = asyncio.Semaphore(self.max_pending)
+        loop = asyncio.get_event_loop()
+        async with self._pending:
+            if self.executor_type == self.EXECUTOR_PROCESS:
+                return await loop.run_in_executor(
+                    self.executor, _predict_file, clf_key,
+                    preprocess.__name__, windows)
+            return await loop.run_in_executor(
+                self.executor, _predict_windows, preprocess, clf, windows)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
     def __str__(self):
         return '<Analyzer bool_clf={}, type_clf={}>'.format(
             self.bool_clf, self.type_clf)
@@ -8,6 +8,10 @@ import warnings
 import sys
 import logging
 import copy
+import hashlib
+import json
+import os
+import pandas as pd
 
 logger = logging.getLogger(__name__)
 logger.setLevel("INFO")
@@ -23,6 +27,9 @@ class Arff:
     To do: Change backend to use Pandas dataframe
     """
 
+    CACHE_SUFFIX = ".npy"
+    CHUNK_ROWS = 1000 # data rows parsed at a time
+
     def __init__(self, arff=None, row_idx=None, col_idx=None, label_count=None, name="Untitled", numeric=True, missing=float("NaN")):
         """
         Args:
@@ -84,95 +91,239 @@ class Arff:
         self.str_to_enum = []
         self.enum_to_str = []
 
-    def load_arff(self, filename):
-        """Load matrix from an ARFF file"""
+    def load_arff(self, filename, cache=True):
+        """Load matrix from an ARFF file
+
+        The @data section is parsed CHUNK_ROWS rows at a time straight into a
+        preallocated array. With cache (numeric data only), that array is a
+        memory-mapped <filename>.npy sidecar, and later loads map it instead of
+        parsing again while the file's size and mtime (or, if only the mtime
+        changed, its SHA-1) match the ones recorded in <filename>.npy.json.
+
+        Args:
+            filename (str): Path to the arff file
+            cache (bool): Use and keep the .npy sidecar
+        """
         self.data = None
         self.attr_names = []
+        self.attr_types = []
         self.str_to_enum = []
         self.enum_to_str = []
-        reading_data = False
-
-        rows = []  # we read data into array of rows, then convert into array of columns
-
-        with open(filename) as f:
-            for line in f.readlines():
-                line = line.strip()  # why was this rstrip()?
-                if len(line) > 0 and line[0] != '%':
-                    if not reading_data:
-                        if line.lower().startswith("@relation"):
-                            self.dataset_name = line[9:].strip()
-                        elif line.lower().startswith("@attribute"):
-                            attr_def = line[10:].strip()
-                            if attr_def[0] == "'":
-                                attr_def = attr_def[1:]
-                                attr_name = attr_def[:attr_def.index("'")]
-                                attr_def = attr_def[attr_def.index("'") + 1:].strip()
-                            else:
-                                search = re.search(r'(\w*)\s*(.*)', attr_def)
-                                attr_name = search.group(1)
-                                attr_def = search.group(2)
-                                # Remove white space from atribute values
-                                attr_def = "".join(attr_def.split())
-
-                            self.attr_names += [attr_name]
-
-                            str_to_enum = {}
-                            enum_to_str = {}
-                            if attr_def.lower() in ["real", "continuous"]:
-                                self.attr_types.append("continuous")
-                            elif attr_def.lower() == "integer":
-                                self.attr_types.append("ordinal")
-                            else:
-                                # attribute is discrete
-                                assert attr_def[0] == '{' and attr_def[-1] == '}'
-                                attr_def = attr_def[1:-1]
-                                attr_vals = attr_def.split(",")
-                                val_idx = 0
-                                for val in attr_vals:
-                                    val = val.strip()
-                                    enum_to_str[val_idx] = val
-                                    str_to_enum[val] = val_idx
-                                    val_idx += 1
-                                self.attr_types.append("nominal")
-                            self.enum_to_str.append(enum_to_str)
-                            self.str_to_enum.append(str_to_enum)
-
-                        elif line.lower().startswith("@data"):
-                            reading_data = True
 
-                    else:
-                        # reading data
-                        val_idx = 0
-                        # print("{}".format(line))
-                        vals = line.split(",")
-                        if self.numeric:
-                            row = np.zeros(len(vals))
-                        else:
-                            row = np.empty(len(vals), dtype=object)
-
-                        for i,val in enumerate(vals):
-                            val = val.strip()
-                            if not val:
-                                raise Exception("Missing data element in row with data '{}'".format(line))
-                            else:
-                                if self.numeric: # record indices for nominal variables
-                                    row[val_idx] = float(
-                                        self.MISSING if val == "?" else self.str_to_enum[val_idx].get(val, val))
-                                else: # record actual values
-                                    row[val_idx] = self.MISSING if val == "?" else val
-
-
-                                # Capture missings in str_to_enum
-                                # if val == "?" and self.str_to_enum[i] and not "?" in self.str_to_enum:
-                                #
-                                #     num = max(self.str_to_enum[i].values())
-                                #     self.str_to_enum[i]["?"] = num
-                                #     self.enum_to_str[i][num] = "?"
-
-                            val_idx += 1
-                        rows += [row]
-        self.data = np.array(rows)
+        with open(filename, 'rb') as f:
+            data_offset = self._load_header(f)
+            cache = cache and self.numeric
+            if cache:
+                self.data = self._load_cache(filename)
+                if self.data is not None:
+                    logger.debug("Loaded ARFF data from cache")
+                    return
+
+            rows, digest = self._scan_data(f, data_offset)
+            shape = (rows, len(self.attr_names))
+            dtype = np.float64 if self.numeric else object
+            cache_file = filename + self.CACHE_SUFFIX
+            data = None
+            if cache:
+                try:
+                    data = np.lib.format.open_memmap(
+                        cache_file + '.tmp', mode='w+', dtype=dtype,
+                        shape=shape)
+                except OSError as e:
+                    warnings.warn("Could not create ARFF cache: {}".format(e))
+                    cache = False
+            if data is None:
+                data = np.empty(shape, dtype=dtype)
+            try:
+                self._parse_data(f, data_offset, data)
+            except Exception:
+                if cache:
+                    del data
+                    os.remove(cache_file + '.tmp')
+                raise
+
+        if not cache:
+            self.data = data
+            return
+        data.flush()
+        del data
+        self._save_cache(filename, digest)
+        self.data = np.load(cache_file, mmap_mode='c')
+
+    def _parse_header_line(self, line):
+        """Parse one line before @data. Returns True at the @data line."""
+        if line.lower().startswith("@relation"):
+            self.dataset_name = line[9:].strip()
+        elif line.lower().startswith("@attribute"):
+            attr_def = line[10:].strip()
+            if attr_def[0] == "'":
+                attr_def = attr_def[1:]
+                attr_name = attr_def[:attr_def.index("'")]
+                attr_def = attr_def[attr_def.index("'") + 1:].strip()
+            else:
+                search = re.search(r'(\w*)\s*(.*)', attr_def)
+                attr_name = search.group(1)
+                attr_def = search.group(2)
+                # Remove white space from atribute values
+                attr_def = "".join(attr_def.split())
+
+            self.attr_names += [attr_name]
+
+            str_to_enum = {}
+            enum_to_str = {}
+            if attr_def.lower() in ["real", "continuous"]:
+                self.attr_types.append("continuous")
+            elif attr_def.lower() == "integer":
+                self.attr_types.append("ordinal")
+            else:
+                # attribute is discrete
+                assert attr_def[0] == '{' and attr_def[-1] == '}'
+                attr_def = attr_def[1:-1]
+                attr_vals = attr_def.split(",")
+                val_idx = 0
+                for val in attr_vals:
+                    val = val.strip()
+                    enum_to_str[val_idx] = val
+                    str_to_enum[val] = val_idx
+                    val_idx += 1
+                self.attr_types.append("nominal")
+            self.enum_to_str.append(enum_to_str)
+            self.str_to_enum.append(str_to_enum)
+
+        elif line.lower().startswith("@data"):
+            return True
+        return False
+
+    def _load_header(self, f):
+        """Parse the header of an open (binary) arff file. Returns the offset of the data."""
+        for line in f:
+            line = line.decode().strip()
+            if len(line) > 0 and line[0] != '%':
+                if self._parse_header_line(line):
+                    return f.tell()
+        raise Exception("No @data section found")
+
+    def _scan_data(self, f, data_offset):
+        """Count the data rows and hash the whole file in one read"""
+        digest = hashlib.sha1()
+        f.seek(0)
+        rows = 0
+        for line in f:
+            digest.update(line)
+            if f.tell() > data_offset:
+                line = line.strip()
+                if len(line) > 0 and line[:1] != b'%':
+                    rows += 1
+        return rows, digest.hexdigest()
+
+    def _parse_data(self, f, data_offset, out):
+        """Parse the @data section in chunks into the preallocated array out"""
+        columns = len(self.attr_names)
+        nominal = {i: enum for i, enum in enumerate(self.str_to_enum) if enum}
+        dtypes = {i: object if i in nominal or not self.numeric else np.float64
+                  for i in range(columns)}
+        f.seek(data_offset)
+        reader = pd.read_csv(
+            f, header=None, names=list(range(columns)), dtype=dtypes,
+            comment='%', quotechar="'", skipinitialspace=True,
+            na_values=["?"], keep_default_na=False, skip_blank_lines=True,
+            chunksize=self.CHUNK_ROWS, engine='c')
+
+        strings = [i for i, dtype in dtypes.items() if dtype is object]
+        row = 0
+        try:
+            for chunk in reader:
+                if strings and (chunk[strings] == "").to_numpy().any():
+                    raise ValueError("Empty data element")
+                values = self._chunk_values(chunk, nominal)
+                if row + len(values) > len(out):
+                    raise Exception("More data rows than counted")
+                out[row:row + len(values)] = values
+                row += len(values)
+        except ValueError:
+            # An empty field fails to convert (or is read as ''), report it
+            # the way the line-by-line parser did
+            self._check_missing(f, data_offset)
+            raise
+        if row != len(out):
+            raise Exception("Expected {} data rows, parsed {}".format(len(out), row))
+
+    def _chunk_values(self, chunk, nominal):
+        """Returns the parsed chunk as a float64 (numeric) or object array"""
+        if self.numeric: # record indices for nominal variables
+            for i, str_to_enum in nominal.items():
+                column = chunk[i].str.strip()
+                values = column.map(str_to_enum)
+                unknown = values.isna() & column.notna()
+                if unknown.any():
+                    values[unknown] = column[unknown].astype(np.float64)
+                chunk[i] = values.astype(np.float64)
+            values = chunk.to_numpy(dtype=np.float64)
+            if not np.isnan(self.MISSING):
+                values[np.isnan(values)] = self.MISSING
+        else: # record actual values, stripped as the values are split
+            values = chunk.apply(lambda column: column.str.strip()) \
+                .to_numpy(dtype=object, copy=True)
+            values[pd.isna(values) | (values == "?")] = self.MISSING
+        return values
 
+    def _check_missing(self, f, data_offset):
+        """Raises the line-by-line parser's error for the first data row with an empty element"""
+        f.seek(data_offset)
+        for line in f:
+            line = line.decode().strip()
+            if len(line) == 0 or line[0] == '%':
+                continue
+            if any(not val.strip() for val in line.split(",")):
+                raise Exception("Missing data element in row with data '{}'".format(line))
+
+    def _load_cache(self, filename):
+        """Returns the cached data of the arff file, or None if it is missing or stale"""
+        cache_file = filename + self.CACHE_SUFFIX
+        try:
+            with open(cache_file + '.json') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        stat = os.stat(filename)
+        if meta.get('size') != stat.st_size or \
+                meta.get('missing') != repr(self.MISSING) or \
+                meta.get('columns') != len(self.attr_names):
+            return None
+        if meta.get('mtime_ns') != stat.st_mtime_ns:
+            # Touched or copied: only the content decides
+            digest = hashlib.sha1()
+            with open(filename, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+            if meta.get('sha1') != digest.hexdigest():
+                return None
+            meta['mtime_ns'] = stat.st_mtime_ns
+            self._write_cache_meta(cache_file, meta)
+        try:
+            return np.load(cache_file, mmap_mode='c')
+        except (OSError, ValueError):
+            return None
+
+    def _save_cache(self, filename, digest):
+        """Moves a freshly parsed cache in place and records what it was parsed from"""
+        cache_file = filename + self.CACHE_SUFFIX
+        stat = os.stat(filename)
+        if os.path.exists(cache_file + '.json'):
+            os.remove(cache_file + '.json')
+        os.replace(cache_file + '.tmp', cache_file)
+        self._write_cache_meta(cache_file, {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha1': digest,
+            'missing': repr(self.MISSING),
+            'columns': len(self.attr_names)
+        })
+
+    def _write_cache_meta(self, cache_file, meta):
+        with open(cache_file + '.json.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(cache_file + '.json.tmp', cache_file + '.json')
 
     @property
     def instance_count(self):
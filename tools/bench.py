@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+from argparse import ArgumentParser
+import time
+import uuid
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker as dbmaker
+
+from data import models
+from .bulk import ReadingWriter
+
+
+def make_session(db, sensors):
+    session = models.Session(
+        id=uuid.uuid4(), athlete=uuid.uuid4(),
+        sport=models.Session.Sport.SKATING, start=0, end=0,
+        sensors=[models.SensorPlacement(
+            id=uuid.uuid4(), sensor='bench-{}'.format(i),
+            location=models.SensorPlacement.Location(i % 6))
+            for i in range(sensors)])
+    db.add(session)
+    db.commit()
+    return session
+
+
+def make_readings(count, rate):
+    timestamps = np.rint(np.arange(count) * (1000.0 / rate)).astype(np.int64)
+    values = np.random.standard_normal((count, 9)).astype(np.float32)
+    return timestamps, values
+
+
+def save_orm(db, placements, timestamps, values):
+    # Previous save_session path: a legacy Reading and its accelerometer,
+    # gyroscope and magnetometer rows added per reading, one commit
+    for placement in placements:
+        for timestamp, row in zip(timestamps.tolist(), values.tolist()):
+            reading_id = uuid.uuid4()
+            accel = models.AccelerometerReading(
+                reading_id=reading_id, x=row[0], y=row[1], z=row[2],
+                units=models.AccelerometerReading.UNITS)
+            gyro = models.GyroscopeReading(
+                reading_id=reading_id, x=row[3], y=row[4], z=row[5],
+                units=models.GyroscopeReading.UNITS)
+            mag = models.MagnetometerReading(
+                reading_id=reading_id, x=row[6], y=row[7], z=row[8],
+                units=models.MagnetometerReading.UNITS)
+            db.add(models.Reading(
+                id=reading_id, sensor=placement.id, timestamp=timestamp,
+                accelerometer=accel, gyroscope=gyro, magnetometer=mag))
+            db.add(accel)
+            db.add(gyro)
+            db.add(mag)
+    db.commit()
+
+
+def save_bulk(writer, placements, timestamps, values):
+    for placement in placements:
+        writer.write(placement.id, timestamps, values)
+
+
+def clear(db):
+    for model in [models.AccelerometerReading, models.GyroscopeReading,
+                  models.MagnetometerReading, models.Reading,
+                  models.SensorReading]:
+        db.query(model).delete()
+    db.commit()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        description='Benchmark saving a session\'s readings')
+    parser.add_argument('-u', '--url', default='sqlite://',
+                        help='sqlalchemy database url (default: in memory)')
+    parser.add_argument('-m', '--minutes', type=float, default=60,
+                        help='Session length in minutes')
+    parser.add_argument('-s', '--sensors', type=int, default=3,
+                        help='# sensors in the session')
+    parser.add_argument('-r', '--rate', type=float, default=52,
+                        help='Sample rate in Hz')
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    models.Base.metadata.create_all(engine)
+    db = dbmaker(bind=engine)()
+    placements = make_session(db, args.sensors).sensors
+    timestamps, values = make_readings(
+        int(args.minutes * 60 * args.rate), args.rate)
+    total = len(timestamps) * len(placements)
+    print('{} readings ({} sensors x {})'.format(
+        total, len(placements), len(timestamps)))
+
+    runs = [('orm', lambda: save_orm(db, placements, timestamps, values)),
+            ('executemany', lambda: save_bulk(
+                ReadingWriter(engine, use_copy=False),
+                placements, timestamps, values))]
+    if ReadingWriter(engine).use_copy:
+        runs.append(('copy', lambda: save_bulk(
+            ReadingWriter(engine, use_copy=True),
+            placements, timestamps, values)))
+
+    for name, run in runs:
+        clear(db)
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        print('{:<12} {:8.2f}s {:10.0f} readings/s'.format(
+            name, elapsed, total / elapsed))
+    clear(db)
+    db.close()
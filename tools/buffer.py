@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+
+import threading
+
+import numpy as np
+
+from settings import BUFFER_CAPACITY, BUFFER_WINDOW
+
+
+class SensorBuffer:
+    """
+    Preallocated columnar storage for the readings of one sensor placement
+    while its session is recording.
+
+    Timestamps are kept in an int64 array and the nine channels
+    (accelerometer, gyroscope, magnetometer x/y/z) in a parallel
+    (capacity, 9) float32 array. When the end of the allocation is reached
+    the readings that still need to be kept are moved back to the front
+    (growing the allocation if they fill more than half of it), so the
+    retained readings are always contiguous and windows are zero-copy
+    slices. Slices are only valid until the next append.
+
+    Only readings not yet written to the database and the latest `keep`
+    readings (the analysis window) need to stay in memory, so with readings
+    flushed regularly the buffer stays the size of a window plus a flush.
+    Readings at or before the latest flushed timestamp are rejected as
+    duplicates, which keeps the duplicate index as small as the buffer.
+
+    Readings are appended on the event loop and written from the database
+    workers, so appending, copying out unflushed readings and marking them
+    flushed hold the buffer's lock.
+
+    ...
+
+    Attributes
+    ----------
+    CHANNELS : int
+        # values stored per reading
+    placement : SensorPlacement
+        Sensor placement the readings belong to
+    keep : int
+        # latest readings kept in memory after they are flushed
+    units : tuple(str, str, str)
+        Accelerometer, gyroscope and magnetometer units, taken from the
+        first reading
+    count : int
+        # readings appended since the session started
+    flushed : int
+        # readings already written to the database
+
+    Methods
+    -------
+    append(timestamp:int, values:list[float], units:tuple)
+        Adds a reading unless one with the same timestamp is already stored.
+        Returns True if the reading was added.
+    extend(timestamps:list[int], values:list[list[float]], units:tuple)
+        Adds a batch of readings, skipping duplicate timestamps. Returns the
+        # readings added.
+    contains(timestamp:int)
+        True if a reading with the timestamp is stored or was flushed
+    window(size:int, end:int optional)
+        Returns (timestamps, values) of the latest `size` readings, or of the
+        `size` readings before absolute index `end`
+    unflushed()
+        Returns (timestamps, values) of the readings not written to the
+        database yet
+    copy_unflushed()
+        Returns a copy of unflushed(), safe to use from another thread
+    get_unflushed_count()
+        Returns # readings not written to the database yet
+    mark_flushed(count:int optional)
+        Marks readings as written, allowing their rows to be reused
+    """
+
+    CHANNELS = 9
+
+    def __init__(self, placement, keep=BUFFER_WINDOW,
+                 capacity=BUFFER_CAPACITY):
+        """
+        Parameters
+        ----------
+        placement : SensorPlacement
+            Sensor placement the readings belong to
+        keep : int, optional
+            # latest readings kept in memory after they are flushed
+        capacity : int, optional
+            # readings to preallocate
+        """
+
+        self.placement = placement
+        self.keep = keep
+        self.units = None
+        self.count = 0
+        self.flushed = 0
+        # Absolute index of the reading stored in row 0
+        self._offset = 0
+        # Timestamps of the readings in memory, for duplicate detection
+        self._index = set()
+        # Latest timestamp written to the database
+        self._flushed_until = None
+        self.lock = threading.Lock()
+        self._timestamps = np.empty(capacity, dtype=np.int64)
+        self._values = np.empty((capacity, self.CHANNELS), dtype=np.float32)
+
+    def __len__(self):
+        return self.count
+
+    def _retain_from(self):
+        # Oldest absolute index that must stay in memory
+        return min(self.flushed, self.count - self.keep)
+
+    def _reserve(self, size):
+        used = self.count - self._offset
+        capacity = len(self._timestamps)
+        if used + size <= capacity:
+            return
+
+        start = max(self._retain_from(), self._offset) - self._offset
+        kept = used - start
+        # Dropped readings are all flushed, the watermark covers them
+        self._index.difference_update(self._timestamps[:start].tolist())
+        if kept + size > capacity // 2:
+            capacity = max(2 * capacity, kept + size)
+            timestamps = np.empty(capacity, dtype=np.int64)
+            values = np.empty((capacity, self.CHANNELS), dtype=np.float32)
+        else:
+            timestamps, values = self._timestamps, self._values
+        timestamps[:kept] = self._timestamps[start:used]
+        values[:kept] = self._values[start:used]
+        self._timestamps, self._values = timestamps, values
+        self._offset += start
+
+    def contains(self, timestamp):
+        return timestamp in self._index or (
+            self._flushed_until is not None and
+            timestamp <= self._flushed_until)
+
+    def append(self, timestamp, values, units=None):
+        with self.lock:
+            if self.contains(timestamp):
+                return False
+            if self.units is None:
+                self.units = units
+
+            self._reserve(1)
+            row = self.count - self._offset
+            self._timestamps[row] = timestamp
+            self._values[row] = values
+            self._index.add(timestamp)
+            self.count += 1
+            return True
+
+    def extend(self, timestamps, values, units=None):
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float32)
+        with self.lock:
+            return self._extend(timestamps, values, units)
+
+    def _extend(self, timestamps, values, units):
+        keep = []
+        for i, timestamp in enumerate(timestamps.tolist()):
+            if not self.contains(timestamp):
+                self._index.add(timestamp)
+                keep.append(i)
+        if len(keep) == 0:
+            return 0
+        if len(keep) < len(timestamps):
+            timestamps, values = timestamps[keep], values[keep]
+        if self.units is None:
+            self.units = units
+
+        size = len(timestamps)
+        self._reserve(size)
+        row = self.count - self._offset
+        self._timestamps[row:row + size] = timestamps
+        self._values[row:row + size] = values
+        self.count += size
+        return size
+
+    def window(self, size, end=None):
+        if end is None:
+            end = self.count
+        start = max(end - size, self._offset) - self._offset
+        end -= self._offset
+        return self._timestamps[start:end], self._values[start:end]
+
+    def unflushed(self):
+        start = self.flushed - self._offset
+        end = self.count - self._offset
+        return self._timestamps[start:end], self._values[start:end]
+
+    def copy_unflushed(self):
+        with self.lock:
+            timestamps, values = self.unflushed()
+            return timestamps.copy(), values.copy()
+
+    def get_unflushed_count(self):
+        return self.count - self.flushed
+
+    def mark_flushed(self, count=None):
+        with self.lock:
+            self._mark_flushed(count)
+
+    def _mark_flushed(self, count):
+        if count is None:
+            count = self.count
+        flushed = min(self.flushed + count, self.count)
+        if flushed > self.flushed:
+            start, end = self.flushed - self._offset, flushed - self._offset
+            latest = int(self._timestamps[start:end].max())
+            if self._flushed_until is None or latest > self._flushed_until:
+                self._flushed_until = latest
+        self.flushed = flushed
+
+    def __str__(self):
+        return '<SensorBuffer sensor={}, count={}, flushed={}>'.format(
+            self.placement.sensor, self.count, self.flushed)
+
+
+class LiveSession:
+    """
+    A session that is currently recording. Wraps the Session model with a
+    SensorBuffer for each of its sensor placements.
+
+    ...
+
+    Attributes
+    ----------
+    session : Session
+        Session model that is saved when the session ends
+    placements : dict<str, SensorPlacement>
+        Sensor placements keyed by sensor serial
+    buffers : dict<uuid, SensorBuffer>
+        Reading buffers keyed by sensor placement id
+    reading_count : int
+        # readings added to the session, kept up to date on every append
+    saved : bool
+        True once the session and its placements are in the database, so
+        their readings can be flushed
+
+    Methods
+    -------
+    get_buffer(serial:str)
+        Returns the buffer of the sensor with the serial. None if not found.
+    append(serial:str, timestamp:int, values:list[float], units:tuple)
+        Adds a reading to the sensor's buffer. Returns True if it was added.
+    extend(serial:str, timestamps:list[int], values:list[list[float]],
+           units:tuple)
+        Adds a batch of readings to the sensor's buffer. Returns the
+        # readings added.
+    get_reading_count(serial:str optional)
+        Returns # of readings in the session, or from the sensor with the
+        serial
+    """
+
+    def __init__(self, session, keep=BUFFER_WINDOW):
+        """
+        Parameters
+        ----------
+        session : Session
+            Session model being recorded
+        keep : int, optional
+            # latest readings per sensor kept in memory after they are
+            flushed
+        """
+
+        self.session = session
+        self.placements = {sensor.sensor: sensor for sensor in session.sensors}
+        self.buffers = {
+            sensor.id: SensorBuffer(sensor, keep=keep)
+            for sensor in session.sensors}
+        self.reading_count = 0
+        self.saved = False
+
+    def get_buffer(self, serial):
+        sensor = self.placements.get(serial)
+        if sensor is None:
+            return None
+        return self.buffers[sensor.id]
+
+    def append(self, serial, timestamp, values, units=None):
+        buffer = self.get_buffer(serial)
+        if buffer is None or not buffer.append(timestamp, values, units):
+            return False
+        self.reading_count += 1
+        return True
+
+    def extend(self, serial, timestamps, values, units=None):
+        buffer = self.get_buffer(serial)
+        if buffer is None:
+            return 0
+        added = buffer.extend(timestamps, values, units)
+        self.reading_count += added
+        return added
+
+    def get_reading_count(self, serial=None):
+        if serial is None:
+            return self.reading_count
+        buffer = self.get_buffer(serial)
+        if buffer is None:
+            return 0
+        return buffer.count
+
+    def __str__(self):
+        return '<LiveSession session={}, buffers={}>'.format(
+            self.session.id, len(self.buffers))
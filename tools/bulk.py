@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+import io
+
+from data import models
+from settings import BULK_CHUNK_SIZE
+
+
+class ReadingWriter:
+    """
+    Writes buffered readings straight to the sensor_reading table without
+    building ORM objects.
+
+    Readings are written in chunks, each in its own transaction. On
+    PostgreSQL with psycopg2 chunks are streamed with COPY FROM STDIN,
+    otherwise they are inserted with one executemany per chunk.
+
+    ...
+
+    Attributes
+    ----------
+    engine : sqlalchemy.Engine
+        Engine connected to the database
+    chunk_size : int
+        # readings written per transaction
+    use_copy : bool
+        True if chunks are written with COPY
+
+    Methods
+    -------
+    write(placement_id:uuid, timestamps:np.ndarray, values:np.ndarray,
+          committed:callable optional)
+        Writes readings of one sensor placement, calling committed(count)
+        after each chunk's transaction. Returns # readings written.
+    write_buffer(buffer:SensorBuffer)
+        Writes a buffer's unflushed readings, marking each chunk flushed
+        once it is committed
+    """
+
+    COLUMNS = ['sensor', 'timestamp'] + models.SensorReading.CHANNELS
+
+    def __init__(self, engine, chunk_size=BULK_CHUNK_SIZE, use_copy=None):
+        """
+        Parameters
+        ----------
+        engine : sqlalchemy.Engine
+            Engine connected to the database
+        chunk_size : int, optional
+            # readings written per transaction
+        use_copy : bool, optional
+            Force COPY on or off. Defaults to on for PostgreSQL/psycopg2.
+        """
+
+        self.engine = engine
+        self.chunk_size = chunk_size
+        if use_copy is None:
+            use_copy = engine.dialect.name == 'postgresql' and \
+                engine.dialect.driver == 'psycopg2'
+        self.use_copy = use_copy
+        self.table = models.SensorReading.__table__
+
+    def write(self, placement_id, timestamps, values, committed=None):
+        for start in range(0, len(timestamps), self.chunk_size):
+            end = start + self.chunk_size
+            if self.use_copy:
+                self._copy(placement_id, timestamps[start:end],
+                           values[start:end])
+            else:
+                self._insert(placement_id, timestamps[start:end],
+                             values[start:end])
+            if committed is not None:
+                committed(len(timestamps[start:end]))
+        return len(timestamps)
+
+    def write_buffer(self, buffer):
+        # Marked chunk by chunk, so chunks committed before a failure are
+        # not written again by the next flush
+        timestamps, values = buffer.copy_unflushed()
+        return self.write(buffer.placement.id, timestamps, values,
+                          committed=buffer.mark_flushed)
+
+    def _insert(self, placement_id, timestamps, values):
+        rows = [
+            dict(zip(self.COLUMNS, [placement_id, timestamp] + row))
+            for timestamp, row in zip(timestamps.tolist(), values.tolist())]
+        with self.engine.begin() as conn:
+            conn.execute(self.table.insert(), rows)
+
+    def _copy(self, placement_id, timestamps, values):
+        prefix = '{},'.format(placement_id)
+        data = io.StringIO()
+        for timestamp, row in zip(timestamps.tolist(), values.tolist()):
+            data.write(prefix)
+            data.write(str(timestamp))
+            for value in row:
+                data.write(',')
+                data.write(repr(value))
+            data.write('\n')
+        data.seek(0)
+
+        sql = 'COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(
+            self.table.name, ', '.join(self.COLUMNS))
+        conn = self.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.copy_expert(sql, data)
+            cursor.close()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import csv
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+from data import models
+from settings import DATASET_CHUNK_SIZE, DATASET_WORKERS
+from tools.analyzer import JUMP_TYPES, Analyzer
+
+try:
+    from numpy.lib.stride_tricks import sliding_window_view
+except ImportError:
+    # numpy < 1.20
+    sliding_window_view = None
+
+
+# Set in each worker process by _init_worker
+_db = None
+_analyzer = None
+
+
+def window_view(values, size, stride=1):
+    """
+    Returns a read-only (windows, size, channels) view of every window of
+    size consecutive readings, starting every stride readings. No readings
+    are copied.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        (count, channels) array of readings, oldest reading first
+    size : int
+        # readings per window
+    stride : int, optional
+        # readings between the starts of consecutive windows
+    """
+
+    count, channels = values.shape
+    if count < size:
+        return np.empty((0, size, channels), dtype=values.dtype)
+    if sliding_window_view is not None:
+        windows = sliding_window_view(values, size, axis=0).swapaxes(1, 2)
+    else:
+        windows = as_strided(
+            values, shape=(count - size + 1, size, channels),
+            strides=(values.strides[0],) + values.strides, writeable=False)
+    return windows[::stride]
+
+
+def read_labels(filename):
+    """
+    Reads a label file with one (jump, take-off, landing) row per jump, as
+    in classifiers/labels/fake_label.csv. Returns a list of
+    (type:str, take_off:int, landing:int), with types named as in
+    JUMP_TYPES; a leading rotation count ('1flip') is dropped.
+    """
+
+    with open(filename, newline='') as f:
+        rows = list(csv.reader(f))
+    labels = []
+    for row in rows[1:]:
+        if len(row) < 3:
+            continue
+        name = row[0].strip().lower().lstrip('0123456789')
+        if name not in JUMP_TYPES:
+            raise ValueError('Unknown jump type {} in {}'.format(
+                row[0], filename))
+        labels.append((name, int(row[1]), int(row[2])))
+    return labels
+
+
+def _init_worker(bool_size, type_size, type_interval, type_agg_method):
+    from .db import DBManager
+
+    global _db, _analyzer
+    _db = DBManager(workers=1)
+    _analyzer = Analyzer(
+        bool_window_size=bool_size, type_window_size=type_size,
+        type_sample_interval=type_interval,
+        type_agg_method=type_agg_method, executor='')
+
+
+def _build_session(session_id, labels, stride, by_timestamp, directory):
+    with _db.session_scope() as db:
+        serials = [placement.sensor for placement in db.query(
+            models.SensorPlacement).filter_by(session=session_id)]
+
+    bool_size = _analyzer.bool_window_size
+    type_size = _analyzer.type_window_size
+    # Encoded as Analyzer.predict_event_type decodes its predictions
+    labelled = np.array([
+        (take_off, landing, JUMP_TYPES.index(name))
+        for name, take_off, landing in labels], dtype=np.int64).reshape(-1, 3)
+    bool_parts, type_parts = [], []
+    for serial in serials:
+        timestamps, values = _db.get_reading_slice(session_id, serial)
+        spans = labelled.copy()
+        if by_timestamp:
+            spans[:, 0] = np.searchsorted(timestamps, spans[:, 0])
+            spans[:, 1] = np.searchsorted(
+                timestamps, spans[:, 1], side='right') - 1
+
+        # Bool windows are positive if they hold a whole jump
+        windows = window_view(values, bool_size, stride)
+        starts = np.arange(len(windows)) * stride
+        jumps = (spans[:, 0] >= starts[:, None]) & \
+            (spans[:, 1] < starts[:, None] + bool_size)
+        bool_parts.append((windows, jumps.any(axis=1)))
+
+        # Type windows are labelled with the jump their middle reading is in
+        windows = window_view(values, type_size, stride)
+        middles = np.arange(len(windows)) * stride + type_size // 2 - 1
+        inside = (spans[:, 0] <= middles[:, None]) & \
+            (middles[:, None] <= spans[:, 1])
+        keep = inside.any(axis=1)
+        if keep.any():
+            type_parts.append((
+                windows[keep], spans[inside.argmax(axis=1)[keep], 2]))
+
+    bool_file = _write_part(
+        os.path.join(directory, '{}-bool.npy'.format(session_id)),
+        _analyzer.featurize_bool, bool_parts)
+    type_file = _write_part(
+        os.path.join(directory, '{}-type.npy'.format(session_id)),
+        _analyzer.featurize_type, type_parts)
+    return bool_file, type_file
+
+
+def _write_part(filename, featurize, parts):
+    # Featurizes windows chunk by chunk into a memory-mapped .npy, one row
+    # per window with the label in the last column
+    rows = sum(len(windows) for windows, _ in parts)
+    if rows == 0:
+        return None
+    columns = None
+    out = None
+    row = 0
+    for windows, labels in parts:
+        for start in range(0, len(windows), DATASET_CHUNK_SIZE):
+            end = start + DATASET_CHUNK_SIZE
+            features = featurize(windows[start:end])
+            if out is None:
+                columns = features.shape[1] + 1
+                out = np.lib.format.open_memmap(
+                    filename, mode='w+', dtype=np.float32,
+                    shape=(rows, columns))
+            out[row:row + len(features), :-1] = features
+            out[row:row + len(features), -1] = labels[start:end]
+            row += len(features)
+    out.flush()
+    del out
+    return filename
+
+
+class DatasetBuilder:
+    """
+    Builds training matrices for the bool and type classifiers from stored
+    sessions and their jump labels, in the exact feature layouts of
+    Analyzer.preprocess_bool and Analyzer.preprocess_type.
+
+    Every window of every sensor's readings is taken at once as a strided
+    view (numpy's sliding_window_view, or an equivalent as_strided view on
+    numpy < 1.20) and featurized in chunks of DATASET_CHUNK_SIZE windows.
+    Sessions are built in parallel in a process pool, each worker writing
+    its rows to a memory-mapped .npy file that is then appended to the
+    output, so memory stays bounded by the chunk size.
+
+    Label files hold one (jump, take-off, landing) row per jump, with
+    take-off and landing given as reading indices (or timestamps). A bool
+    window is labelled 1 if it holds a whole jump, 0 otherwise. Type
+    windows are only kept if their middle reading is within a jump, and
+    are labelled with the jump's type, by its index in JUMP_TYPES (the
+    ARFF nominal values are declared in that order), so a model trained on
+    them predicts what Analyzer.predict_event_type decodes.
+
+    Formats
+    --------------------------------------------
+    arff : <name>-bool.arff and <name>-type.arff, loadable with
+           tools.arff.Arff (label_count=1)
+    npy  : <name>-bool.npy and <name>-type.npy, float32 matrices with the
+           label's index in the last column, as Arff stores nominal
+           attributes (use Arff(np.load(file), label_count=1)), and
+           <name>-bool.json and <name>-type.json holding the attribute
+           names and label values
+
+    ...
+
+    Attributes
+    ----------
+    FORMATS : tuple(str)
+        Supported formats
+    BOOL_LABELS : list[str]
+        Values of the bool label
+    analyzer : Analyzer
+        Analyzer whose window sizes and featurization are used
+    stride : int
+        # readings between the starts of consecutive windows
+    by_timestamp : bool
+        True if take-off and landing are reading timestamps instead of
+        indices
+    workers : int
+        # processes sessions are built in
+
+    Methods
+    -------
+    build(output:str, labels:dict<uuid, list[tuple]>, fmt:str optional)
+        Builds the bool and type datasets of the labelled sessions. Returns
+        the paths written.
+    """
+
+    ARFF = 'arff'
+    NPY = 'npy'
+    FORMATS = (ARFF, NPY)
+
+    BOOL_LABELS = ['0', '1']
+
+    def __init__(self, analyzer=None, stride=1, by_timestamp=False,
+                 workers=DATASET_WORKERS):
+        """
+        Parameters
+        ----------
+        analyzer : Analyzer, optional
+            Analyzer whose window sizes and featurization are used. Defaults
+            to one with the server's window sizes.
+        stride : int, optional
+            # readings between the starts of consecutive windows
+        by_timestamp : bool, optional
+            True if take-off and landing are reading timestamps
+        workers : int, optional
+            # processes sessions are built in
+        """
+
+        if analyzer is None:
+            analyzer = Analyzer(executor='')
+        self.analyzer = analyzer
+        self.stride = stride
+        self.by_timestamp = by_timestamp
+        self.workers = workers
+
+    def build(self, output, labels, fmt=ARFF):
+        for jumps in labels.values():
+            for name, _, _ in jumps:
+                if name not in JUMP_TYPES:
+                    raise ValueError('Unknown jump type {}'.format(name))
+        directory = tempfile.mkdtemp()
+        try:
+            # Spawned rather than forked, as the other process pools
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(
+                    max_workers=self.workers, initializer=_init_worker,
+                    initargs=(self.analyzer.bool_window_size,
+                              self.analyzer.type_window_size,
+                              self.analyzer.type_interval,
+                              self.analyzer.type_agg_method),
+                    mp_context=context) as executor:
+                futures = [
+                    executor.submit(
+                        _build_session, session_id, jumps, self.stride,
+                        self.by_timestamp, directory)
+                    for session_id, jumps in labels.items()]
+                parts = [future.result() for future in futures]
+
+            bool_header = self.analyzer.get_bool_header(
+                self.analyzer.bool_window_size)
+            type_header = self.analyzer.get_type_header(
+                self.analyzer.type_window_size)
+            return [
+                self._write(output + '-bool', fmt, 'jump_bool', bool_header,
+                            'Jump', self.BOOL_LABELS,
+                            [part[0] for part in parts]),
+                self._write(output + '-type', fmt, 'jump_type', type_header,
+                            'Type', JUMP_TYPES, [part[1] for part in parts])]
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def _write(self, name, fmt, relation, header, label, values, parts):
+        parts = [np.load(part, mmap_mode='r') for part in parts
+                 if part is not None]
+        rows = sum(len(part) for part in parts)
+        if fmt == self.NPY:
+            filename = name + '.npy'
+            with open(name + '.json', 'w') as f:
+                json.dump({'relation': relation,
+                           'attributes': header + [label],
+                           'labels': values}, f)
+            out = np.lib.format.open_memmap(
+                filename, mode='w+', dtype=np.float32,
+                shape=(rows, len(header) + 1))
+            row = 0
+            for part in parts:
+                for start in range(0, len(part), DATASET_CHUNK_SIZE):
+                    chunk = part[start:start + DATASET_CHUNK_SIZE]
+                    out[row:row + len(chunk)] = chunk
+                    row += len(chunk)
+            out.flush()
+            del out
+            return filename
+
+        filename = name + '.arff'
+        with open(filename, 'w') as f:
+            f.write('@RELATION {}\n\n'.format(relation))
+            for column in header:
+                f.write("@ATTRIBUTE '{}' REAL\n".format(column))
+            f.write("@ATTRIBUTE '{}' {{{}}}\n\n@DATA\n".format(
+                label, ','.join(values)))
+            for part in parts:
+                for start in range(0, len(part), DATASET_CHUNK_SIZE):
+                    chunk = part[start:start + DATASET_CHUNK_SIZE]
+                    lines = io.StringIO()
+                    np.savetxt(lines, chunk[:, :-1], fmt='%.9g', delimiter=',')
+                    for line, index in zip(lines.getvalue().splitlines(),
+                                           chunk[:, -1].astype(int)):
+                        f.write('{},{}\n'.format(line, values[index]))
+        return filename
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        description='Build bool and type classifier datasets from labelled '
+                    'sessions')
+    parser.add_argument('-o', '--output', required=True,
+                        help='Output name, -bool/-type and the extension '
+                             'are appended')
+    parser.add_argument('-f', '--format', default=DatasetBuilder.ARFF,
+                        choices=DatasetBuilder.FORMATS,
+                        help='File format (default: arff)')
+    parser.add_argument('-s', '--session', nargs=2, action='append',
+                        required=True, metavar=('SESSION', 'LABELS'),
+                        help='Session id and its label file, repeatable')
+    parser.add_argument('--stride', type=int, default=1,
+                        help='Readings between the starts of windows')
+    parser.add_argument('--timestamps', action='store_true',
+                        help='Take-off and landing are reading timestamps '
+                             'instead of indices')
+    parser.add_argument('-w', '--workers', type=int, default=DATASET_WORKERS,
+                        help='# processes sessions are built in')
+    args = parser.parse_args()
+
+    labels = {session_id: read_labels(filename)
+              for session_id, filename in args.session}
+    builder = DatasetBuilder(stride=args.stride, by_timestamp=args.timestamps,
+                             workers=args.workers)
+    print('{} -- Building datasets from {} sessions'.format(
+        datetime.now(), len(labels)))
+    for filename in builder.build(args.output, labels, fmt=args.format):
+        print('{} -- Wrote {}'.format(datetime.now(), filename))
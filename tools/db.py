@@ -1,7 +1,13 @@
 #!/usr/bin/env python3
 
-from sqlalchemy import create_engine
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+import numpy as np
+from sqlalchemy import and_, create_engine, func, or_, select
 from sqlalchemy.orm import sessionmaker as dbmaker
+import threading
 import urllib.parse
 import uuid
 
@@ -10,6 +16,10 @@ from db_settings import (DB_DIALECT, DB_DRIVER, DB_HOST, DB_NAME, DB_PASS,
 from data import models
 from model_keys import *
 from .analyzer import Analyzer
+from .buffer import LiveSession
+from settings import (BUFFER_WINDOW, DB_WORKERS, FLUSH_ROWS,
+                      READINGS_PAGE_SIZE, REQUEST_PAGE_SIZE)
+from .bulk import ReadingWriter
 
 
 class DBManager:
@@ -17,52 +27,115 @@ class DBManager:
     Database class to handle DB connections, lookups, and updates.
     Also maintains recording session data.
 
+    Every method that queries or commits is a unit of work with its own
+    sqlalchemy Session from a pooled engine, so it can run in the worker
+    pool through run() instead of blocking the event loop. Methods that
+    only touch recording sessions (buffers, counters, windows) stay on the
+    event loop.
+
     ...
 
     Attributes
     ----------
-    db : sqlalchemy.Session
-        Connection to database
-    sessions : dict<str, Session>
-        Sessions currently accepting sensor data.
+    DETAILS : tuple(str)
+        Detail levels of get_session_page: DETAIL_SESSIONS (sessions and
+        their sensor placements), DETAIL_EVENTS (plus events) and
+        DETAIL_READINGS (plus every reading)
+    DB : sqlalchemy.orm.sessionmaker
+        Makes the Session of each unit of work
+    engine : sqlalchemy.Engine
+        Engine the connections are made from
+    executor : concurrent.futures.ThreadPoolExecutor
+        Worker pool the units of work run in
+    writer : ReadingWriter
+        Bulk writer for buffered readings
+    sessions : dict<str, LiveSession>
+        Sessions currently accepting sensor data, with their reading buffers.
     
     Methods
     -------
     _construct_engine_url(dialect:str, driver:str, host:str, name:str,
                           user:str, pw:str, port:int)
         Creates url for sqlalchemy engine to connect to database
+    session_scope()
+        Context manager yielding a sqlalchemy Session that is committed
+        (or rolled back) and closed on exit
+    run(func:callable, *args)
+        Coroutine, runs a unit of work in the worker pool
     get_athlete_sessions(athlete:str)
         Returns a list of Sessions for the requested athlete
     get_session_readings(session_id:uuid)
         Returns a list of Readings for the requested Session
-    save()
-        Commits changes to the database
-    save_session(session:Session)
-        Updates Session in the database
+    get_all_sessions(athletes:list[str])
+        Returns a list of Sessions for the requested athletes
+    get_session_page(athletes:list[str], detail:str optional,
+                     cursor:str optional, limit:int optional)
+        Returns (dictionaries, next cursor) of the requested athletes'
+        Sessions ordered by start time, at most `limit` of them after
+        `cursor`. The next cursor is None on the last page.
+    get_reading_page(session_id:uuid, sensor_id:str optional,
+                     start:int optional, end:int optional,
+                     cursor:str optional, limit:int optional)
+        Returns (dictionaries, next cursor) of a session's saved Readings
+        between start and end, ordered by timestamp
+    save_session(live:LiveSession)
+        Updates Session in the database. Readings are written in bulk.
     get_session(session_id:uuid)
         Returns the session requested for. If not found, returns None.
+    get_live_session(session_id:uuid)
+        Returns the Session if it is recording, None otherwise
+    is_recording(session_id:uuid)
+        True if the session is currently recording
     start_session(id:uuid, athlete:str, sport:str, start:int,
                   placements:list[Sensor] optional)
-        Initializes a session for recording.
+        Initializes a session for recording. Returns the LiveSession.
         If SensorPlacements are already known, adds those to the Session.
+    create_session(id:uuid)
+        Saves a session started by start_session, after which its
+        readings can be flushed
     end_session(id:uuid, end:int)
-        Saves the Session and removes it from dict of sessions currently
-        being recorded.
+        Removes the session from dict of sessions currently being recorded.
+        Returns the LiveSession to pass to save_session.
     add_event(event_id:uuid, session_id:uuid, event_type:str,
               start:int, end:int)
         Adds the event to the session. If session is already over,
         immediately saves it to database.
     add_reading(session_id:uuid, sensor_id:str, reading_id:uuid,
                 timestamp:int, accel_data:dict, gyro_data:dict, mag_data:dict)
-        Adds a Reading to the session.
-    get_reading_count(session_id:uuid)
-        Returns # of Readings in the session
+        Adds a reading to the sensor's buffer. Returns True if it was added.
+    add_readings(session_id:uuid, sensor_id:str, timestamps:list[int],
+                 values:list[list[float]], units:tuple)
+        Adds a batch of readings to the sensor's buffer in one copy. Returns
+        the # readings added.
+    get_reading_count(session_id:uuid, sensor_id:str optional)
+        Returns # of Readings in the session, or from one of its sensors.
+        Recording sessions use their running counters, saved sessions a
+        COUNT query.
     get_readings(session_id:uuid)
         Returns the list of Readings in the session 
+    needs_flush(session_id:uuid, sensor_id:str)
+        True if the sensor has FLUSH_ROWS readings waiting to be written
+    flush_sessions()
+        Writes the buffered readings of every saved recording session to
+        the database. Returns # readings written.
+    get_reading_slice(session_id:uuid, sensor_id:str, start:int optional,
+                      end:int optional)
+        Returns (timestamps, values) arrays of a sensor's readings between
+        start and end, including the unflushed readings of a recording
+        session. None if the sensor is not in the session.
+    get_window(session_id:uuid, sensor_id:str, size:int, end:int optional)
+        Returns (timestamps, values) arrays of the latest readings of a sensor
+        in a recording session, or of the readings before index `end`
     """
 
+    DETAIL_SESSIONS = 'sessions'
+    DETAIL_EVENTS = 'events'
+    DETAIL_READINGS = 'readings'
+    DETAILS = (DETAIL_SESSIONS, DETAIL_EVENTS, DETAIL_READINGS)
+
     def __init__(self, dialect=DB_DIALECT, driver=DB_DRIVER, host=DB_HOST,
-                 name=DB_NAME, user=DB_USER, pw=DB_PASS, port=DB_PORT):
+                 name=DB_NAME, user=DB_USER, pw=DB_PASS, port=DB_PORT,
+                 window_size=BUFFER_WINDOW, workers=DB_WORKERS):
         """
         Parameters (defaults defined by db_settings)
         --------------------------------------------
@@ -80,17 +153,32 @@ class DBManager:
             User password for database
         port : int, optional        
             Port database is listening on
+        window_size : int, optional
+            # latest readings per sensor kept in memory once written, the
+            largest window the analyzer needs
+        workers : int, optional
+            # threads running units of work
         """
 
         url = self._construct_engine_url(dialect, driver, host, name,
                                          user, pw, port)
-        engine = create_engine(url)
-        models.Base.metadata.create_all(engine)
-        DB = dbmaker(bind=engine)
-        self.db = DB()
-        
+        pool = {}
+        if not url.startswith('sqlite'):
+            # A connection per worker, plus one for shutdown's last flush
+            pool = {'pool_size': workers + 1, 'pool_pre_ping': True}
+        self.engine = create_engine(url, **pool)
+        models.Base.metadata.create_all(self.engine)
+        # Objects outlive their unit of work (recording sessions, results
+        # sent to clients), so keep their loaded state after commit
+        self.DB = dbmaker(bind=self.engine, expire_on_commit=False)
+        self.writer = ReadingWriter(self.engine)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        # Only one flush may write a buffer at a time
+        self._flush_lock = threading.Lock()
+
         # Map of athletic session currently recording
         self.sessions = {}
+        self.window_size = window_size
 
     def _construct_engine_url(self, dialect, driver, host, name,
                               user, pw, port):
@@ -110,51 +198,177 @@ class DBManager:
         
         return url + '/{}'.format(name)
 
+    @contextmanager
+    def session_scope(self):
+        db = self.DB()
+        try:
+            yield db
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def run(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args))
+
     def get_athlete_sessions(self, athlete):
-        return models.Session.find_by_athlete(self.db, athlete)
+        with self.session_scope() as db:
+            return models.Session.find_by_athlete(db, athlete)
 
     def get_session_readings(self, session_id):
         if session_id in self.sessions.keys():
-            return self.sessions[session_id].get_readings()
-        return list(models.Session.get_readings(self.db, session_id))
+            return self.get_readings(session_id)
+        with self.session_scope() as db:
+            return list(models.Session.get_session_readings(db, session_id))
 
     def get_all_sessions(self, athletes):
-        sessions = []
-        for athlete in athletes:
-            sessions.extend(self.get_athlete_sessions(athlete))
-        return sessions
-
-    def save_session(self, id):
-        session = self.sessions[id]
-        self.db.add(session)
-        for event in session.events:
-            self.db.add(event)
-            for subevent in event.subevents:
-                self.db.add(subevent)
-            for quality in event.qualitative_attributes:
-                self.db.add(quality)
-            for quantity in event.quantitative_attributes:
-                self.db.add(quantity)
-        for sensor in session.sensors:
-            self.db.add(sensor)
-            for reading in sensor.readings:
-                self.db.add(reading)
-                self.db.add(reading.accelerometer)
-                self.db.add(reading.gyroscope)
-                self.db.add(reading.magnetometer)
-        self.save()
-
-    def save(self):
-        self.db.commit()
+        with self.session_scope() as db:
+            return models.Session.find_by_athletes(db, athletes)
+
+    def _parse_cursor(self, cursor):
+        # Cursors are '<position>:<uuid>' of the last row of the page
+        try:
+            position, id = cursor.split(':', 1)
+            return int(position), uuid.UUID(id)
+        except (AttributeError, ValueError):
+            raise ValueError('Invalid cursor {}'.format(cursor))
+
+    def _parse_limit(self, limit, page_size):
+        # Client supplied, pages hold page_size rows at most
+        if limit is None:
+            return page_size
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            raise ValueError('Invalid limit {}'.format(limit))
+        if limit < 1:
+            raise ValueError('Limit must be at least 1, not {}'.format(limit))
+        return min(limit, page_size)
+
+    def get_session_page(self, athletes, detail=DETAIL_READINGS, cursor=None,
+                         limit=None):
+        if detail not in self.DETAILS:
+            raise ValueError('Unknown detail level {}'.format(detail))
+        limit = self._parse_limit(limit, REQUEST_PAGE_SIZE)
+        Session = models.Session
+
+        with self.session_scope() as db:
+            query = db.query(Session).options(*Session.dictionary_options(
+                events=detail != self.DETAIL_SESSIONS,
+                readings=detail == self.DETAIL_READINGS)).filter(
+                    Session.athlete.in_(athletes))
+            if cursor is not None:
+                start, id = self._parse_cursor(cursor)
+                query = query.filter(or_(
+                    Session.start > start,
+                    and_(Session.start == start, Session.id > id)))
+            # One extra row tells if there is another page
+            sessions = query.order_by(Session.start, Session.id).limit(
+                limit + 1).all()
+
+            next_cursor = None
+            if len(sessions) > limit:
+                sessions = sessions[:limit]
+                next_cursor = '{}:{}'.format(sessions[-1].start,
+                                             sessions[-1].id)
+            return [session.dictionary(
+                db, events=detail != self.DETAIL_SESSIONS,
+                readings=detail == self.DETAIL_READINGS)
+                for session in sessions], next_cursor
+
+    def get_reading_page(self, session_id, sensor_id=None, start=None,
+                         end=None, cursor=None, limit=None):
+        limit = self._parse_limit(limit, READINGS_PAGE_SIZE)
+        Reading = models.SensorReading
+
+        with self.session_scope() as db:
+            query = db.query(models.SensorPlacement).filter_by(
+                session=session_id)
+            if sensor_id is not None:
+                query = query.filter_by(sensor=sensor_id)
+            # Looked up once for every reading on the page
+            placements = {placement.id: placement for placement in query}
+            if len(placements) == 0:
+                return [], None
+
+            query = db.query(Reading).filter(
+                Reading.sensor.in_(list(placements.keys())))
+            if start is not None:
+                query = query.filter(Reading.timestamp >= start)
+            if end is not None:
+                query = query.filter(Reading.timestamp <= end)
+            if cursor is not None:
+                timestamp, id = self._parse_cursor(cursor)
+                query = query.filter(or_(
+                    Reading.timestamp > timestamp,
+                    and_(Reading.timestamp == timestamp, Reading.sensor > id)))
+            readings = query.order_by(Reading.timestamp, Reading.sensor).limit(
+                limit + 1).all()
+
+            next_cursor = None
+            if len(readings) > limit:
+                readings = readings[:limit]
+                next_cursor = '{}:{}'.format(readings[-1].timestamp,
+                                             readings[-1].sensor)
+            return [reading.dictionary(db, placement=placements[reading.sensor])
+                    for reading in readings], next_cursor
+
+    def save_session(self, live):
+        session = live.session
+        with self.session_scope() as db:
+            db.add(session)
+            for event in session.events:
+                db.add(event)
+                for subevent in event.subevents:
+                    db.add(subevent)
+                for quality in event.qualitative_attributes:
+                    db.add(quality)
+                for quantity in event.quantitative_attributes:
+                    db.add(quantity)
+            for buffer in live.buffers.values():
+                if buffer.units is not None:
+                    placement = buffer.placement
+                    placement.accelerometer_units, placement.gyroscope_units, \
+                        placement.magnetometer_units = buffer.units
+                db.add(buffer.placement)
+
+        # Readings bypass the ORM, in chunks once their placements exist
+        with self._flush_lock:
+            for buffer in live.buffers.values():
+                self.writer.write_buffer(buffer)
+
+    def _build_readings(self, buffer):
+        # Converts the unsaved rows of a SensorBuffer into SensorReadings
+        timestamps, values = buffer.copy_unflushed()
+        return [
+            models.SensorReading(
+                sensor=buffer.placement.id, timestamp=timestamp,
+                **dict(zip(models.SensorReading.CHANNELS, row)))
+            for timestamp, row in zip(timestamps.tolist(), values.tolist())]
 
     def shutdown(self):
+        self.executor.shutdown(wait=True)
         self.sessions = {}
-        self.db.close()
+        self.engine.dispose()
 
     def get_session(self, id):
-        if id in self.sessions.keys():
-            return self.sessions[id]
-        return self.db.query(models.Session).filter_by(id=id).one()
+        session = self.get_live_session(id)
+        if session is not None:
+            return session
+        with self.session_scope() as db:
+            return db.query(models.Session).filter_by(id=id).one()
+
+    def get_live_session(self, id):
+        live = self.sessions.get(id)
+        if live is None:
+            return None
+        return live.session
+
+    def is_recording(self, id):
+        return id in self.sessions
 
     def start_session(self, id, athlete, sport, start, placements=[]):
         end = start + 24 * 60 * 60 # 24 hours from the start time; default for creation
@@ -165,18 +379,29 @@ class DBManager:
                 sensor=placement[SENSOR_ID], session=id,
                 location=models.SensorPlacement.Location(int(placement[LOCATION])),
                 readings=[])
-            self.db.add(sensor)
             sensors.append(sensor)
 
-        self.sessions[id] = models.Session(
+        session = models.Session(
             id=id, athlete=athlete, sport=models.Session.Sport(int(sport)),
-            start=start, end=end, sensors=sensors)
+            start=start, end=end, sensors=sensors, events=[])
+        live = LiveSession(session, keep=self.window_size)
+        self.sessions[id] = live
+        return live
+
+    def create_session(self, id):
+        live = self.sessions.get(id)
+        if live is None:
+            return
+        # Saved right away so readings can be flushed while recording
+        with self.session_scope() as db:
+            db.add(live.session)
+        live.saved = True
 
     def end_session(self, id, end):
-        if id in self.sessions.keys():
-            self.sessions[id].end = end
-            self.save_session(id)
-            del self.sessions[id]
+        live = self.sessions.pop(id, None)
+        if live is not None:
+            live.session.end = end
+        return live
 
     def add_event(self, event_id, session_id, event_type, start, end,
                   bool_clf, type_clf):
@@ -185,75 +410,152 @@ class DBManager:
         qualities, quantities, subevents = [], [], []
         session_over = False
 
-        if session_id not in self.sessions.keys():
-            session_over = True
-            # Session might be over before the classifier returned the event type
-            session = self.db.query(models.Session).filter_by(id=session_id).one()
-            if session is None:
-                # Can't find the session, ignore request
-                return
-        else:
-            session = self.sessions[session_id]
-        
+        session = self.get_live_session(session_id)
         event = models.Event(
             id=event_id, type=event_type, session=session_id,
             bool_classifier=bool_clf, type_classifier=type_clf,
             start=start, end=end, subevents=subevents,
             qualitative_attributes=qualities,
             quantitative_attributes=quantities)
-        session.events.append(event)
 
-        if session_over:
-            self.db.add(event)
-            self.db.add(session)
-            self.save()
+        if session is not None:
+            session.events.append(event)
+            return event
+
+        # Session might be over before the classifier returned the event type
+        with self.session_scope() as db:
+            session = db.query(models.Session).filter_by(id=session_id).one()
+            if session is None:
+                # Can't find the session, ignore request
+                return
+            session.events.append(event)
+            db.add(event)
         
         return event
 
     def add_reading(self, session_id, sensor_id, reading_id, timestamp,
                     accel_data, gyro_data, mag_data):
-        if session_id not in self.sessions.keys() or \
-            self.sessions[session_id].get_sensor_by_serial(sensor_id) is None:
-            return
-        sensor = self.sessions[session_id].get_sensor_by_serial(sensor_id)
-        if sensor.get_reading_by_timestamp(timestamp) is None:
-            accel = models.AccelerometerReading(
-                reading_id=reading_id,
-                x=accel_data[X],
-                y=accel_data[Y],
-                z=accel_data[Z],
-                units=accel_data[UNITS])
-            self.db.add(accel)
-            gyro = models.GyroscopeReading(
-                reading_id=reading_id,
-                x=gyro_data[X],
-                y=gyro_data[Y],
-                z=gyro_data[Z],
-                units=gyro_data[UNITS])
-            self.db.add(gyro)
-            mag = models.MagnetometerReading(
-                reading_id=reading_id,
-                x=mag_data[X],
-                y=mag_data[Y],
-                z=mag_data[Z],
-                units=mag_data[UNITS])
-
-            reading = models.Reading(
-                id=reading_id, sensor=sensor.id, timestamp=timestamp,
-                accelerometer=accel, gyroscope=gyro, magnetometer=mag)
-            self.db.add(reading)
-            sensor.readings.append(reading)
-
-    def get_reading_count(self, session_id):
         if session_id not in self.sessions.keys():
-            return len(models.Session.get_session_readings(
-                self.db, session_id))
-        return len(self.sessions[session_id].get_readings())
+            return False
+        return self.sessions[session_id].append(
+            sensor_id, timestamp,
+            [accel_data[X], accel_data[Y], accel_data[Z],
+             gyro_data[X], gyro_data[Y], gyro_data[Z],
+             mag_data[X], mag_data[Y], mag_data[Z]],
+            units=(accel_data[UNITS], gyro_data[UNITS], mag_data[UNITS]))
+
+    def add_readings(self, session_id, sensor_id, timestamps, values,
+                     units=None):
+        if session_id not in self.sessions.keys():
+            return 0
+        return self.sessions[session_id].extend(
+            sensor_id, timestamps, values, units=units)
+
+    def get_reading_count(self, session_id, sensor_id=None):
+        if session_id in self.sessions.keys():
+            return self.sessions[session_id].get_reading_count(sensor_id)
+
+        with self.session_scope() as db:
+            query = db.query(func.count()).select_from(
+                models.SensorReading).join(
+                    models.SensorReading.placement).filter(
+                        models.SensorPlacement.session == session_id)
+            if sensor_id is not None:
+                query = query.filter(
+                    models.SensorPlacement.sensor == sensor_id)
+            return query.scalar()
 
     def get_readings(self, session_id):
+        live = self.sessions.get(session_id)
+        with self.session_scope() as db:
+            if live is None:
+                return models.Session.get_session_readings(db, session_id)
+            readings = []
+            for buffer in live.buffers.values():
+                # Copied before querying, so rows flushed in between are
+                # skipped by the query rather than returned twice
+                unflushed = self._build_readings(buffer)
+                query = db.query(models.SensorReading).filter_by(
+                    sensor=buffer.placement.id)
+                if unflushed:
+                    query = query.filter(models.SensorReading.timestamp < min(
+                        reading.timestamp for reading in unflushed))
+                readings.extend(query.order_by(
+                    models.SensorReading.timestamp).all())
+                readings.extend(unflushed)
+            return readings
+
+    def needs_flush(self, session_id, sensor_id):
+        if session_id not in self.sessions.keys():
+            return False
+        buffer = self.sessions[session_id].get_buffer(sensor_id)
+        return buffer is not None and \
+            buffer.get_unflushed_count() >= FLUSH_ROWS
+
+    def flush_sessions(self):
+        flushed = 0
+        with self._flush_lock:
+            for live in list(self.sessions.values()):
+                if not live.saved:
+                    continue
+                for buffer in live.buffers.values():
+                    if buffer.get_unflushed_count() > 0:
+                        flushed += self.writer.write_buffer(buffer)
+        return flushed
+
+    def get_reading_slice(self, session_id, sensor_id, start=None, end=None):
+        table = models.SensorReading.__table__
+        with self.session_scope() as db:
+            placement = db.query(models.SensorPlacement).filter_by(
+                session=session_id, sensor=sensor_id).first()
+            if placement is None:
+                return None
+
+            # Copied before querying, so rows flushed in between are
+            # skipped by the query rather than returned twice
+            live = self.sessions.get(session_id)
+            unflushed = None
+            if live is not None:
+                unflushed = live.buffers[placement.id].copy_unflushed()
+
+            query = select([table.c.timestamp] + [
+                table.c[channel] for channel in models.SensorReading.CHANNELS
+            ]).where(table.c.sensor == placement.id)
+            if start is not None:
+                query = query.where(table.c.timestamp >= start)
+            if end is not None:
+                query = query.where(table.c.timestamp <= end)
+            if unflushed is not None and len(unflushed[0]) > 0:
+                # Buffered rows are in arrival order, not timestamp order
+                query = query.where(
+                    table.c.timestamp < int(unflushed[0].min()))
+            rows = db.execute(query.order_by(table.c.timestamp)).fetchall()
+
+        rows = np.array(rows, dtype=np.float64).reshape(
+            -1, 1 + len(models.SensorReading.CHANNELS))
+        timestamps = rows[:, 0].astype(np.int64)
+        values = rows[:, 1:].astype(np.float32)
+        if unflushed is not None:
+            keep = np.ones(len(unflushed[0]), dtype=bool)
+            if start is not None:
+                keep &= unflushed[0] >= start
+            if end is not None:
+                keep &= unflushed[0] <= end
+            # Buffers keep arrival order
+            order = np.argsort(unflushed[0][keep], kind='stable')
+            timestamps = np.concatenate(
+                [timestamps, unflushed[0][keep][order]])
+            values = np.concatenate([values, unflushed[1][keep][order]])
+        return timestamps, values
+
+    def get_window(self, session_id, sensor_id, size, end=None):
         if session_id not in self.sessions.keys():
-            return models.Session.get_session_readings(self.db, session_id)
-        return self.sessions[session_id].get_readings()
+            return None
+        buffer = self.sessions[session_id].get_buffer(sensor_id)
+        if buffer is None:
+            return None
+        return buffer.window(size, end=end)
 
     def __str__(self):
-        return 'DBManager:\nengine: {}\ndb: {}'.format(self.engine, self.db)
+        return 'DBManager:\nengine: {}\nsessions: {}'.format(
+            self.engine, len(self.sessions))
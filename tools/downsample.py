@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+
+MINMAX = 'minmax'
+LTTB = 'lttb'
+METHODS = (MINMAX, LTTB)
+
+
+def minmax(x, y, points):
+    """
+    Splits the series into points // 2 buckets of consecutive samples and
+    keeps the lowest and highest sample of each, so peaks survive however
+    far the series is reduced.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        Sample times, ascending
+    y : np.ndarray
+        Sample values
+    points : int
+        Target # samples
+
+    Returns
+    -------
+    np.ndarray
+        Ascending indices of the samples kept
+    """
+
+    n = len(x)
+    buckets = points // 2
+    if n <= points or buckets < 1:
+        return np.arange(n)
+
+    y = np.asarray(y)
+    starts = np.linspace(0, n, buckets, endpoint=False).astype(np.int64)
+    counts = np.diff(np.append(starts, n))
+    bucket = np.repeat(np.arange(buckets), counts)
+    indices = []
+    for extreme in (np.minimum, np.maximum):
+        # First sample of each bucket equal to the bucket's extreme
+        hits = np.flatnonzero(
+            y == np.repeat(extreme.reduceat(y, starts), counts))
+        _, first = np.unique(bucket[hits], return_index=True)
+        indices.append(hits[first])
+    return np.unique(np.concatenate(indices))
+
+
+def lttb(x, y, points):
+    """
+    Largest-triangle-three-buckets: keeps the first and last samples and,
+    from each of points - 2 buckets in between, the sample forming the
+    largest triangle with the sample kept before it and the average of the
+    next bucket. Keeps the visual shape of the series with few points.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        Sample times, ascending
+    y : np.ndarray
+        Sample values
+    points : int
+        Target # samples
+
+    Returns
+    -------
+    np.ndarray
+        Ascending indices of the samples kept
+    """
+
+    n = len(x)
+    if n <= points or points < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    # Averages of every bucket, the last point standing in for the bucket
+    # after the last one
+    starts = np.append(edges[:-1], n - 1)
+    counts = np.diff(np.append(starts, n))
+    avg_x = np.add.reduceat(x, starts) / counts
+    avg_y = np.add.reduceat(y, starts) / counts
+
+    indices = np.empty(points, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(points - 2):
+        start, end = edges[i], edges[i + 1]
+        area = np.abs((x[a] - avg_x[i + 1]) * (y[start:end] - y[a]) -
+                      (x[a] - x[start:end]) * (avg_y[i + 1] - y[a]))
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+    return indices
+
+
+def downsample(x, y, points, method=LTTB):
+    """
+    Returns the indices of the samples kept by the method (MINMAX or LTTB)
+    """
+
+    if method == MINMAX:
+        return minmax(x, y, points)
+    if method == LTTB:
+        return lttb(x, y, points)
+    raise ValueError('Unknown downsampling method {}'.format(method))
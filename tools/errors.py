@@ -2,3 +2,11 @@
 
 class AnalyzerError(Exception):
     pass
+
+
+class FrameError(Exception):
+    pass
+
+
+class ExportError(Exception):
+    pass
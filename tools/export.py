@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+
+from argparse import ArgumentParser
+from datetime import datetime
+import os
+import shutil
+import tempfile
+import zipfile
+
+import numpy as np
+from sqlalchemy import func, select
+
+from data import models
+from settings import EXPORT_CHUNK_SIZE
+from tools.errors import ExportError
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+class SessionExporter:
+    """
+    Exports sessions for training pipelines as one columnar file per table:
+    sessions, placements, events and readings.
+
+    Rows are read with Core queries, never as ORM objects, and readings
+    are written chunk by chunk as they are fetched from the database cursor
+    (a server-side cursor on PostgreSQL), so memory stays bounded by the
+    chunk size however many readings are exported.
+
+    Readings refer to their sensor placement by its row in the placements
+    table, which holds the session, sensor serial, location and units.
+
+    Archives are zip files written straight to a stream, which does not
+    have to be seekable (e.g. an HTTP response), each file being written
+    into the archive as it is produced.
+
+    Formats
+    --------------------------------------------
+    parquet : <table>.parquet, one row group per chunk (needs pyarrow)
+    arrow   : <table>.arrow, Arrow IPC files, one record batch per chunk
+              (needs pyarrow)
+    npz     : <table>.npz, one array per column. Reading columns are filled
+              chunk by chunk through memory-mapped .npy files before being
+              stored in the .npz, so they are only streamed once complete.
+
+    ...
+
+    Attributes
+    ----------
+    FORMATS : tuple(str)
+        Supported formats
+    engine : sqlalchemy.Engine
+        Engine connected to the database
+    chunk_size : int
+        # readings fetched and written at a time
+
+    Methods
+    -------
+    find_sessions(sessions:list[uuid] optional, athletes:list[uuid] optional)
+        Returns the ids of the requested sessions and of every session of
+        the requested athletes
+    check_format(fmt:str)
+        Raises ExportError if the format is unknown or unavailable
+    export(directory:str, sessions:list[uuid], fmt:str optional)
+        Writes the sessions to the directory. Returns # readings exported.
+    write_archive(out:file, sessions:list[uuid], fmt:str optional)
+        Writes the export as a zip archive (uncompressed, the formats are
+        compressed already or memory-mappable) to the writable stream.
+        Returns # readings exported.
+    """
+
+    PARQUET = 'parquet'
+    ARROW = 'arrow'
+    NPZ = 'npz'
+    FORMATS = (PARQUET, ARROW, NPZ)
+
+    READING_COLUMNS = ['placement', 'timestamp'] + \
+        models.SensorReading.CHANNELS
+
+    def __init__(self, engine, chunk_size=EXPORT_CHUNK_SIZE):
+        """
+        Parameters
+        ----------
+        engine : sqlalchemy.Engine
+            Engine connected to the database
+        chunk_size : int, optional
+            # readings fetched and written at a time
+        """
+
+        self.engine = engine
+        self.chunk_size = chunk_size
+
+    def find_sessions(self, sessions=None, athletes=None):
+        table = models.Session.__table__
+        found = list(sessions or [])
+        if athletes:
+            with self.engine.connect() as conn:
+                found.extend(row[0] for row in conn.execute(
+                    select([table.c.id]).where(table.c.athlete.in_(athletes))))
+        # Sessions named directly may also belong to a requested athlete
+        unique = {}
+        for id in found:
+            unique.setdefault(str(id), id)
+        return list(unique.values())
+
+    def check_format(self, fmt):
+        if fmt not in self.FORMATS:
+            raise ExportError('Unknown export format {}'.format(fmt))
+        if fmt != self.NPZ and pa is None:
+            raise ExportError('Exporting {} needs pyarrow'.format(fmt))
+
+    def export(self, directory, sessions, fmt=PARQUET):
+        self.check_format(fmt)
+        os.makedirs(directory, exist_ok=True)
+        return self._export(
+            lambda name: open(os.path.join(directory, name), 'wb'),
+            sessions, fmt)
+
+    def write_archive(self, out, sessions, fmt=PARQUET):
+        self.check_format(fmt)
+        with zipfile.ZipFile(out, 'w', zipfile.ZIP_STORED,
+                             allowZip64=True) as zf:
+            # Sizes are unknown until a file is written
+            count = self._export(
+                lambda name: zf.open(name, 'w', force_zip64=True),
+                sessions, fmt)
+        out.flush()
+        return count
+
+    def _export(self, open_file, sessions, fmt):
+        # open_file(name) returns a writable file the table is written to
+        with self.engine.connect() as conn:
+            placements = self._placements(conn, sessions)
+            index = {id: i for i, id in enumerate(placements['id'])}
+            placements['id'] = [str(id) for id in placements['id']]
+            self._write_table(open_file, 'sessions', fmt,
+                              self._sessions(conn, sessions))
+            self._write_table(open_file, 'placements', fmt, placements)
+            self._write_table(open_file, 'events', fmt,
+                              self._events(conn, sessions))
+
+            count = self._reading_count(conn, list(index.keys()))
+            chunks = self._reading_chunks(conn, list(index.keys()), index)
+            try:
+                with open_file('readings.{}'.format(fmt)) as f:
+                    if fmt == self.NPZ:
+                        return self._write_npz_readings(f, count, chunks)
+                    return self._write_arrow_readings(f, fmt, chunks)
+            finally:
+                # Closes the cursor while its connection is still open
+                chunks.close()
+
+    def _rows(self, conn, query, columns):
+        # Small tables, read whole into one list per column
+        rows = conn.execute(query).fetchall()
+        return {name: [row[i] for row in rows]
+                for i, name in enumerate(columns)}
+
+    def _sessions(self, conn, sessions):
+        table = models.Session.__table__
+        columns = ['id', 'athlete', 'sport', 'start', 'end']
+        data = self._rows(conn, select(
+            [table.c[name] for name in columns]).where(
+                table.c.id.in_(sessions)).order_by(table.c.start), columns)
+        data['id'] = [str(id) for id in data['id']]
+        data['athlete'] = [str(athlete) for athlete in data['athlete']]
+        data['sport'] = [str(sport) for sport in data['sport']]
+        return data
+
+    def _placements(self, conn, sessions):
+        table = models.SensorPlacement.__table__
+        columns = ['id', 'session', 'sensor', 'location',
+                   'accelerometer_units', 'gyroscope_units',
+                   'magnetometer_units']
+        data = self._rows(conn, select(
+            [table.c[name] for name in columns]).where(
+                table.c.session.in_(sessions)).order_by(
+                    table.c.session, table.c.sensor), columns)
+        data['session'] = [str(session) for session in data['session']]
+        data['location'] = [str(location) for location in data['location']]
+        return data
+
+    def _events(self, conn, sessions):
+        table = models.Event.__table__
+        columns = ['id', 'session', 'type', 'start', 'end',
+                   'bool_classifier', 'type_classifier']
+        data = self._rows(conn, select(
+            [table.c[name] for name in columns]).where(
+                table.c.session.in_(sessions)).order_by(
+                    table.c.session, table.c.start), columns)
+        data['id'] = [str(id) for id in data['id']]
+        data['session'] = [str(session) for session in data['session']]
+        return data
+
+    def _reading_query(self, placements):
+        table = models.SensorReading.__table__
+        return select([table.c.sensor, table.c.timestamp] + [
+            table.c[channel] for channel in models.SensorReading.CHANNELS
+        ]).where(table.c.sensor.in_(placements))
+
+    def _reading_count(self, conn, placements):
+        table = models.SensorReading.__table__
+        return conn.execute(select([func.count()]).where(
+            table.c.sensor.in_(placements))).scalar()
+
+    def _reading_chunks(self, conn, placements, index):
+        table = models.SensorReading.__table__
+        result = conn.execution_options(stream_results=True).execute(
+            self._reading_query(placements).order_by(
+                table.c.sensor, table.c.timestamp))
+        try:
+            while True:
+                rows = result.fetchmany(self.chunk_size)
+                if not rows:
+                    break
+                placement = np.fromiter((index[row[0]] for row in rows),
+                                        dtype=np.int32, count=len(rows))
+                values = np.array([row[1:] for row in rows],
+                                  dtype=np.float64)
+                chunk = {'placement': placement,
+                         'timestamp': values[:, 0].astype(np.int64)}
+                for i, channel in enumerate(models.SensorReading.CHANNELS):
+                    chunk[channel] = values[:, i + 1].astype(np.float32)
+                yield chunk
+        finally:
+            result.close()
+
+    def _write_table(self, open_file, name, fmt, data):
+        with open_file('{}.{}'.format(name, fmt)) as f:
+            if fmt == self.NPZ:
+                np.savez(f, **{column: np.array(values)
+                               for column, values in data.items()})
+                return
+            table = pa.Table.from_pydict(data)
+            if fmt == self.PARQUET:
+                pq.write_table(table, f)
+            else:
+                writer = pa.RecordBatchFileWriter(f, table.schema)
+                writer.write_table(table)
+                writer.close()
+
+    def _write_arrow_readings(self, f, fmt, chunks):
+        schema = pa.schema(
+            [('placement', pa.int32()), ('timestamp', pa.int64())] +
+            [(channel, pa.float32())
+             for channel in models.SensorReading.CHANNELS])
+        count = 0
+        if fmt == self.PARQUET:
+            writer = pq.ParquetWriter(f, schema)
+        else:
+            writer = pa.RecordBatchFileWriter(f, schema)
+        try:
+            for chunk in chunks:
+                batch = pa.RecordBatch.from_arrays(
+                    [pa.array(chunk[column])
+                     for column in self.READING_COLUMNS],
+                    names=self.READING_COLUMNS)
+                if fmt == self.PARQUET:
+                    writer.write_table(pa.Table.from_batches([batch]))
+                else:
+                    writer.write_batch(batch)
+                count += batch.num_rows
+        finally:
+            writer.close()
+        return count
+
+    def _write_npz_readings(self, f, count, chunks):
+        # Columns are filled chunk by chunk on disk, then archived
+        work = tempfile.mkdtemp(prefix='export-')
+        try:
+            columns = {}
+            for name in self.READING_COLUMNS:
+                dtype = np.int32 if name == 'placement' else \
+                    np.int64 if name == 'timestamp' else np.float32
+                columns[name] = np.lib.format.open_memmap(
+                    os.path.join(work, '{}.npy'.format(name)), mode='w+',
+                    dtype=dtype, shape=(count,))
+            written = 0
+            for chunk in chunks:
+                # Readings flushed after the count are left for next time
+                size = min(len(chunk['timestamp']), count - written)
+                for name, column in columns.items():
+                    column[written:written + size] = chunk[name][:size]
+                written += size
+                if written == count:
+                    break
+            for column in columns.values():
+                column.flush()
+            del columns
+
+            with zipfile.ZipFile(f, 'w', zipfile.ZIP_STORED,
+                                 allowZip64=True) as zf:
+                for name in self.READING_COLUMNS:
+                    zf.write(os.path.join(work, '{}.npy'.format(name)),
+                             '{}.npy'.format(name))
+            return written
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    from .db import DBManager
+
+    parser = ArgumentParser(
+        description='Export sessions as columnar files for training')
+    parser.add_argument('-o', '--output', required=True,
+                        help='Directory the files are written to')
+    parser.add_argument('-f', '--format', default=SessionExporter.PARQUET,
+                        choices=SessionExporter.FORMATS,
+                        help='File format (default: parquet)')
+    parser.add_argument('-s', '--session', nargs='*', default=[],
+                        help='Ids of sessions to export')
+    parser.add_argument('-a', '--athlete', nargs='*', default=[],
+                        help='Ids of athletes whose sessions are exported')
+    args = parser.parse_args()
+
+    db = DBManager()
+    exporter = SessionExporter(db.engine)
+    sessions = exporter.find_sessions(args.session, args.athlete)
+    print('{} -- Exporting {} sessions'.format(datetime.now(), len(sessions)))
+    count = exporter.export(args.output, sessions, fmt=args.format)
+    print('{} -- Exported {} readings to {}'.format(
+        datetime.now(), count, args.output))
+    db.shutdown()
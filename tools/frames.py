@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+import math
+import struct
+
+import numpy as np
+
+from data import models
+from tools.errors import FrameError
+
+
+class Frame:
+    """
+    Binary frame of readings from one sensor, sent as a socket.io binary
+    attachment instead of a list of JSON readings.
+
+    Frame layout (little-endian)
+    --------------------------------------------
+    version       : uint8    FRAME_VERSION
+    (padding)     : 3 bytes
+    session       : 36 bytes session id, ASCII, NUL padded, as sent to
+                    start_session
+    sensor        : 16 bytes sensor serial, ASCII, NUL padded
+    start         : int64    timestamp of the first reading, in ms
+    count         : uint32   # readings in the frame
+    rate          : float32  sample rate in Hz
+    values        : count x 9 float32, one row per reading:
+                    accelerometer x/y/z, gyroscope x/y/z, magnetometer x/y/z
+
+    Reading timestamps are start + i * 1000 / rate (rounded). Units are the
+    defaults of the reading models.
+
+    ...
+
+    Attributes
+    ----------
+    session : str
+        Session id
+    sensor : str
+        Sensor serial
+    start : int
+        Timestamp of the first reading
+    rate : float
+        Sample rate in Hz
+    values : np.ndarray
+        (count, 9) float32 array of readings
+
+    Methods
+    -------
+    decode(payload:bytes)
+        Class method, parses a frame. Values are a view into the payload.
+    encode()
+        Returns the frame as bytes
+    timestamps()
+        Returns an int64 array of the reading timestamps
+    """
+
+    FRAME_VERSION = 1
+    HEADER = struct.Struct('<B3x36s16sqIf')
+    UNITS = (models.AccelerometerReading.UNITS,
+             models.GyroscopeReading.UNITS,
+             models.MagnetometerReading.UNITS)
+
+    def __init__(self, session, sensor, start, rate, values):
+        self.session = session
+        self.sensor = sensor
+        self.start = start
+        self.rate = rate
+        self.values = values
+
+    @classmethod
+    def decode(cls, payload):
+        if not isinstance(payload, (bytes, bytearray)):
+            raise FrameError('Frame must be bytes, not {}'.format(
+                type(payload).__name__))
+        if len(payload) < cls.HEADER.size:
+            raise FrameError('Frame is shorter than its header')
+        version, session, sensor, start, count, rate = \
+            cls.HEADER.unpack_from(payload)
+        if version != cls.FRAME_VERSION:
+            raise FrameError('Unsupported frame version {}'.format(version))
+        size = cls.HEADER.size + count * 9 * 4
+        if len(payload) != size:
+            raise FrameError('Frame has {} bytes, expected {}'.format(
+                len(payload), size))
+        if not math.isfinite(rate) or rate <= 0:
+            raise FrameError('Frame sample rate must be positive and finite')
+        try:
+            session = session.rstrip(b'\0').decode('ascii')
+            sensor = sensor.rstrip(b'\0').decode('ascii')
+        except UnicodeDecodeError:
+            raise FrameError('Frame session and sensor must be ASCII')
+
+        values = np.frombuffer(payload, dtype='<f4', count=count * 9,
+                               offset=cls.HEADER.size).reshape(count, 9)
+        return cls(session, sensor, start, rate, values)
+
+    def encode(self):
+        # struct would silently truncate longer fields
+        fields = []
+        for name, value, size in [('session', self.session, 36),
+                                  ('sensor', self.sensor, 16)]:
+            try:
+                value = value.encode('ascii')
+            except UnicodeEncodeError:
+                raise FrameError('Frame {} must be ASCII'.format(name))
+            if len(value) > size:
+                raise FrameError('Frame {} is longer than {} bytes'.format(
+                    name, size))
+            fields.append(value)
+        values = np.ascontiguousarray(self.values, dtype='<f4')
+        header = self.HEADER.pack(
+            self.FRAME_VERSION, fields[0], fields[1], self.start, len(values),
+            self.rate)
+        return header + values.tobytes()
+
+    def timestamps(self):
+        offsets = np.arange(len(self.values)) * (1000.0 / self.rate)
+        return self.start + np.rint(offsets).astype(np.int64)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __str__(self):
+        return '<Frame session={}, sensor={}, start={}, count={}>'.format(
+            self.session, self.sensor, self.start, len(self))
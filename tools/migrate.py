@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+from argparse import ArgumentParser
+from datetime import datetime
+
+from sqlalchemy import and_, exists, func, inspect, select, text
+from sqlalchemy.exc import IntegrityError
+
+from data import models
+from .db import DBManager
+
+
+class ReadingMigrator:
+    """
+    Moves readings from the legacy layout (reading, accelerometer_reading,
+    gyroscope_reading and magnetometer_reading tables) into the single
+    sensor_reading table, and their units onto sensor_placement. Also
+    creates indexes declared after the tables were, which create_all skips
+    for existing tables.
+
+    Every step is one INSERT/UPDATE ... SELECT run by the database, and
+    readings that were already copied are skipped, so it is safe to run
+    the migration again (e.g. after an interruption).
+
+    ...
+
+    Attributes
+    ----------
+    engine : sqlalchemy.Engine
+        Engine connected to the database being migrated
+
+    Methods
+    -------
+    add_placement_units()
+        Adds the units columns to sensor_placement if the table predates
+        them, and fills them from each placement's legacy readings
+    copy_readings()
+        Copies legacy readings into sensor_reading, one per (sensor,
+        timestamp). Returns # rows copied.
+    drop_legacy_readings()
+        Deletes all rows from the legacy reading tables
+    add_indexes()
+        Creates the models' indexes missing from the database. Returns the
+        names of the indexes created.
+    migrate(drop_legacy:bool optional)
+        Runs every step
+    """
+
+    UNITS_COLUMNS = [
+        ('accelerometer_units', models.AccelerometerReading),
+        ('gyroscope_units', models.GyroscopeReading),
+        ('magnetometer_units', models.MagnetometerReading),
+    ]
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def add_placement_units(self):
+        placement = models.SensorPlacement.__table__
+        reading = models.Reading.__table__
+        columns = [column['name'] for column in
+                   inspect(self.engine).get_columns(placement.name)]
+
+        with self.engine.begin() as conn:
+            for name, model in self.UNITS_COLUMNS:
+                if name not in columns:
+                    conn.execute(text(
+                        'ALTER TABLE {} ADD COLUMN {} VARCHAR(10)'.format(
+                            placement.name, name)))
+
+                table = model.__table__
+                units = select([table.c.units]).select_from(
+                    table.join(reading, table.c.reading_id == reading.c.id)
+                ).where(reading.c.sensor == placement.c.id).limit(1).as_scalar()
+                conn.execute(placement.update().where(
+                    placement.c[name].is_(None)).values(
+                        {name: func.coalesce(units, model.UNITS)}))
+
+    def copy_readings(self):
+        reading = models.Reading.__table__
+        accel = models.AccelerometerReading.__table__
+        gyro = models.GyroscopeReading.__table__
+        mag = models.MagnetometerReading.__table__
+        compact = models.SensorReading.__table__
+
+        copied = exists().where(and_(
+            compact.c.sensor == reading.c.sensor,
+            compact.c.timestamp == reading.c.timestamp))
+        query = select([
+            reading.c.sensor, reading.c.timestamp,
+            accel.c.x, accel.c.y, accel.c.z,
+            gyro.c.x, gyro.c.y, gyro.c.z,
+            mag.c.x, mag.c.y, mag.c.z
+        ]).select_from(
+            reading.join(accel, accel.c.reading_id == reading.c.id)
+            .join(gyro, gyro.c.reading_id == reading.c.id)
+            .join(mag, mag.c.reading_id == reading.c.id)
+        ).where(~copied)
+        # Legacy rows may repeat a (sensor, timestamp), keep one of each
+        if self.engine.dialect.name == 'postgresql':
+            query = query.distinct(reading.c.sensor, reading.c.timestamp) \
+                .order_by(reading.c.sensor, reading.c.timestamp, reading.c.id)
+        else:
+            query = query.where(reading.c.id.in_(
+                select([func.min(reading.c.id)]).group_by(
+                    reading.c.sensor, reading.c.timestamp)))
+
+        with self.engine.begin() as conn:
+            result = conn.execute(compact.insert().from_select(
+                ['sensor', 'timestamp'] + models.SensorReading.CHANNELS,
+                query))
+            return result.rowcount
+
+    def drop_legacy_readings(self):
+        with self.engine.begin() as conn:
+            for model in [models.AccelerometerReading,
+                          models.GyroscopeReading,
+                          models.MagnetometerReading,
+                          models.Reading]:
+                conn.execute(model.__table__.delete())
+
+    def add_indexes(self):
+        created = []
+        inspector = inspect(self.engine)
+        for table in models.Base.metadata.sorted_tables:
+            existing = {index['name'] for index in
+                        inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in existing:
+                    continue
+                try:
+                    index.create(bind=self.engine)
+                except IntegrityError as e:
+                    # Legacy rows may repeat a (sensor, timestamp)
+                    print('{} -- Skipped index {}: {}'.format(
+                        datetime.now(), index.name, e.orig))
+                    continue
+                created.append(index.name)
+        return created
+
+    def migrate(self, drop_legacy=False):
+        print('{} -- Adding units to sensor placements'.format(datetime.now()))
+        self.add_placement_units()
+        print('{} -- Copying readings'.format(datetime.now()))
+        copied = self.copy_readings()
+        print('{} -- Copied {} readings'.format(datetime.now(), copied))
+        if drop_legacy:
+            print('{} -- Deleting legacy readings'.format(datetime.now()))
+            self.drop_legacy_readings()
+        print('{} -- Adding indexes'.format(datetime.now()))
+        created = self.add_indexes()
+        print('{} -- Added {} indexes'.format(datetime.now(), len(created)))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        description='Migrate readings to the single-table layout')
+    parser.add_argument('--drop-legacy', action='store_true',
+                        help='Delete the legacy reading rows once copied')
+    args = parser.parse_args()
+
+    db = DBManager()
+    ReadingMigrator(db.engine).migrate(drop_legacy=args.drop_legacy)
+    db.shutdown()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+import multiprocessing
+import os
+import uuid
+
+import numpy as np
+from sqlalchemy import and_, select
+
+from data import models
+from settings import REANALYSIS_WORKERS
+from tools.analyzer import Analyzer, JUMP_TYPES
+from tools.dataset import window_view
+from tools.errors import AnalyzerError
+
+
+# Set in each worker process by _init_worker
+_db = None
+_analyzer = None
+
+
+def _init_worker(bool_file, type_file):
+    from .db import DBManager
+
+    global _db, _analyzer
+    _db = DBManager(workers=1)
+    _analyzer = Analyzer(pickled_bool_clf=bool_file,
+                         pickled_type_clf=type_file, executor='')
+
+
+def _reanalyze_session(session_id, bool_name, type_name):
+    with _db.session_scope() as db:
+        serials = [placement.sensor for placement in db.query(
+            models.SensorPlacement).filter_by(session=session_id)]
+
+    # Same windows as the live analysis: a bool window every bool_interval
+    # readings, ending at the reading count that triggered it
+    bool_size = _analyzer.bool_window_size
+    type_size = _analyzer.type_window_size
+    sensors = []
+    for serial in serials:
+        timestamps, values = _db.get_reading_slice(session_id, serial)
+        ends = np.array(_analyzer.bool_analysis_points(0, len(timestamps)),
+                        dtype=np.int64)
+        if len(ends) > 0:
+            sensors.append((timestamps, values, ends))
+
+    events = []
+    if sensors:
+        found = _analyzer.bool_clf.predict(_analyzer.preprocess_bool(
+            np.concatenate([window_view(values, bool_size)[ends - bool_size]
+                            for _, values, ends in sensors]))) > 0
+
+        typed = []
+        for timestamps, values, ends in sensors:
+            positive, found = found[:len(ends)], found[len(ends):]
+            ends = ends[positive]
+            ends = ends[ends >= type_size]
+            if len(ends) > 0:
+                typed.append((timestamps, values, ends))
+        if typed:
+            types = _analyzer.type_clf.predict(_analyzer.preprocess_type(
+                np.concatenate([window_view(values, type_size)[ends - type_size]
+                                for _, values, ends in typed])))
+            types = iter(types)
+            for timestamps, _, ends in typed:
+                for end in ends.tolist():
+                    events.append({
+                        'id': uuid.uuid4(),
+                        'type': JUMP_TYPES[int(next(types))],
+                        'session': session_id,
+                        'start': int(timestamps[end - type_size]),
+                        'end': int(timestamps[end - 1]),
+                        'bool_classifier': bool_name,
+                        'type_classifier': type_name
+                    })
+
+    table = models.Event.__table__
+    with _db.session_scope() as db:
+        # Running the job again replaces its own events, not the old model's
+        db.execute(table.delete().where(and_(
+            table.c.session == session_id,
+            table.c.bool_classifier == bool_name,
+            table.c.type_classifier == type_name)))
+        if events:
+            db.execute(table.insert(), events)
+    return session_id, len(events)
+
+
+class SessionReanalyzer:
+    """
+    Re-runs event detection on stored sessions with a new pair of
+    classifiers, so historical sessions get events from the new model.
+
+    Sessions are spread across a process pool. Each worker loads the
+    classifiers once, reads every sensor's readings of a session, stacks
+    all of the session's bool windows (the windows the live analysis would
+    have classified, ending every bool_interval readings) and predicts them
+    with one call, then does the same with the type windows of the windows
+    found to hold an event. The prefilter is not applied.
+
+    New events are tagged with the classifiers' file names. Events from
+    older classifiers are kept; events from an earlier run with the same
+    classifiers are replaced.
+
+    ...
+
+    Attributes
+    ----------
+    bool_file : str
+        Path to the pickled bool classifier
+    type_file : str
+        Path to the pickled type classifier
+    bool_name : str
+        bool_classifier of the new events
+    type_name : str
+        type_classifier of the new events
+    workers : int
+        # processes sessions are re-analyzed in
+
+    Methods
+    -------
+    find_sessions(engine:sqlalchemy.Engine, sessions:list[uuid] optional,
+                  athletes:list[uuid] optional, sport:str optional)
+        Static method, returns the ids of the requested sessions, of every
+        session of the requested athletes and/or of the sport (by name,
+        e.g. 'skating'), oldest first. Every session if none are requested.
+    reanalyze(sessions:list[uuid], progress:callable optional)
+        Re-analyzes the sessions, calling progress(session_id, events) as
+        each one is done. Returns # events written.
+    """
+
+    def __init__(self, bool_file, type_file, workers=REANALYSIS_WORKERS):
+        """
+        Parameters
+        ----------
+        bool_file : str
+            Path to the pickled bool classifier
+        type_file : str
+            Path to the pickled type classifier
+        workers : int, optional
+            # processes sessions are re-analyzed in
+        """
+
+        if bool_file is None or type_file is None:
+            raise AnalyzerError(
+                'Re-analysis needs both a bool and a type classifier')
+        self.bool_file = bool_file
+        self.type_file = type_file
+        self.bool_name = os.path.basename(bool_file)
+        self.type_name = os.path.basename(type_file)
+        self.workers = workers
+
+    @staticmethod
+    def find_sessions(engine, sessions=None, athletes=None, sport=None):
+        table = models.Session.__table__
+        query = select([table.c.id]).order_by(table.c.start)
+        requested = []
+        if sessions:
+            requested.append(table.c.id.in_(sessions))
+        if athletes:
+            requested.append(table.c.athlete.in_(athletes))
+        if requested:
+            query = query.where(requested[0] if len(requested) == 1 else
+                                requested[0] | requested[1])
+        if sport is not None:
+            query = query.where(
+                table.c.sport == models.Session.Sport[sport.upper()])
+        with engine.connect() as conn:
+            return [row[0] for row in conn.execute(query)]
+
+    def reanalyze(self, sessions, progress=None):
+        written = 0
+        # Spawned rather than forked: the server starts jobs from a thread,
+        # and a fork copies the locks other threads hold at that moment
+        with ProcessPoolExecutor(
+                max_workers=self.workers, initializer=_init_worker,
+                initargs=(self.bool_file, self.type_file),
+                mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = [
+                executor.submit(_reanalyze_session, session_id,
+                                self.bool_name, self.type_name)
+                for session_id in sessions]
+            for future in as_completed(futures):
+                session_id, count = future.result()
+                written += count
+                if progress is not None:
+                    progress(session_id, count)
+        return written
+
+
+if __name__ == '__main__':
+    from .db import DBManager
+
+    parser = ArgumentParser(
+        description='Re-analyze stored sessions with new classifiers')
+    parser.add_argument('-b', '--bool-classifier', required=True,
+                        help='Pickled bool classifier')
+    parser.add_argument('-t', '--type-classifier', required=True,
+                        help='Pickled type classifier')
+    parser.add_argument('-s', '--session', nargs='*', default=[],
+                        help='Ids of sessions to re-analyze')
+    parser.add_argument('-a', '--athlete', nargs='*', default=[],
+                        help='Ids of athletes whose sessions are re-analyzed')
+    parser.add_argument('--sport',
+                        choices=[str(s) for s in models.Session.Sport],
+                        help='Only re-analyze sessions of the sport')
+    parser.add_argument('-w', '--workers', type=int,
+                        default=REANALYSIS_WORKERS,
+                        help='# processes sessions are re-analyzed in')
+    args = parser.parse_args()
+
+    db = DBManager()
+    reanalyzer = SessionReanalyzer(args.bool_classifier, args.type_classifier,
+                                   workers=args.workers)
+    sessions = reanalyzer.find_sessions(db.engine, args.session, args.athlete,
+                                        args.sport)
+    print('{} -- Re-analyzing {} sessions'.format(
+        datetime.now(), len(sessions)))
+    count = reanalyzer.reanalyze(sessions, progress=lambda id, events: print(
+        '{} -- Session {}: {} events'.format(datetime.now(), id, events)))
+    print('{} -- Wrote {} events'.format(datetime.now(), count))
+    db.shutdown()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+import asyncio
+from collections import OrderedDict
+from datetime import datetime
+import os
+import time
+
+from settings import MODEL_CACHE_BYTES
+
+
+class ModelRegistry:
+    """
+    Per-sport classifiers, kept next to the default ones: the pickles in
+    <clf_dir>/<sport>/ are the sport's versions (named by file, the newest
+    being the latest), while the pickles directly in <clf_dir> stay the
+    Analyzer's defaults for sports without their own models.
+
+    Models are unpickled and warmed up (Analyzer.read_clf, in a thread) the
+    first time a window of their sport needs them. Resident models are kept
+    in least recently used order, and the oldest are evicted once their
+    total footprint, measured as the size of their pickles, goes over
+    max_bytes.
+
+    ...
+
+    Attributes
+    ----------
+    BOOL : str
+        Key of bool classifiers
+    TYPE : str
+        Key of type classifiers
+    analyzer : Analyzer
+        Analyzer the models are loaded and warmed up for
+    dirs : dict<str, str>
+        Classifier directory of each kind
+    max_bytes : int
+        Footprint of the resident models at most, a model larger than it
+        is still kept until the next one is loaded
+    versions : dict<tuple(str, str), OrderedDict<str, str>>
+        Paths of each (kind, sport)'s versions, oldest first
+
+    Methods
+    -------
+    scan()
+        Indexes the versions found in the sport directories
+    resolve(kind:str, sport:str, version:str optional)
+        Returns the path of the sport's model version, by default its
+        latest. None if the sport has no models.
+    get_name(kind:str, sport:str, version:str optional)
+        Returns '<sport>/<version>' of the model resolve() picks, None if
+        the sport has no models
+    get(kind:str, sport:str, version:str optional)
+        Coroutine, returns (classifier, key) of the sport's model, loading
+        it if it is not resident. None if the sport has no models.
+    install(kind:str, sport:str, clf_file:str, name:str)
+        Coroutine, loads an uploaded classifier as the sport's latest
+        version, moving its file into the sport directory. Returns the
+        load timings.
+    get_stats()
+        Returns the resident models and their footprint
+    """
+
+    BOOL = 'bool'
+    TYPE = 'type'
+
+    def __init__(self, analyzer, bool_clf_dir, type_clf_dir,
+                 max_bytes=MODEL_CACHE_BYTES):
+        """
+        Parameters
+        ----------
+        analyzer : Analyzer
+            Analyzer the models are loaded and warmed up for
+        bool_clf_dir : str
+            Directory of the bool classifiers
+        type_clf_dir : str
+            Directory of the type classifiers
+        max_bytes : int, optional
+            Footprint of the resident models at most
+        """
+
+        self.analyzer = analyzer
+        self.dirs = {self.BOOL: bool_clf_dir, self.TYPE: type_clf_dir}
+        self.max_bytes = max_bytes
+        self.versions = {}
+        # Resident models, least recently used first: path -> (clf, key, size)
+        self._resident = OrderedDict()
+        # Loads in progress, so concurrent windows wait for the same load
+        self._loading = {}
+        self.scan()
+
+    def scan(self):
+        versions = {}
+        for kind, clf_dir in self.dirs.items():
+            if not os.path.isdir(clf_dir):
+                continue
+            for sport in sorted(os.listdir(clf_dir)):
+                sport_dir = os.path.join(clf_dir, sport)
+                if not os.path.isdir(sport_dir):
+                    continue
+                files = [os.path.join(sport_dir, f)
+                         for f in os.listdir(sport_dir) if f.endswith('.pkl')]
+                if files:
+                    versions[(kind, sport)] = OrderedDict(
+                        (os.path.basename(f)[:-len('.pkl')], f)
+                        for f in sorted(files, key=os.path.getctime))
+        self.versions = versions
+
+    def resolve(self, kind, sport, version=None):
+        versions = self.versions.get((kind, str(sport)))
+        if not versions:
+            return None
+        if version is None:
+            return next(reversed(versions.values()))
+        return versions.get(version)
+
+    def get_name(self, kind, sport, version=None):
+        path = self.resolve(kind, sport, version)
+        if path is None:
+            return None
+        return '{}/{}'.format(
+            os.path.basename(os.path.dirname(path)),
+            os.path.basename(path)[:-len('.pkl')])
+
+    async def get(self, kind, sport, version=None):
+        path = self.resolve(kind, sport, version)
+        if path is None:
+            return None
+        if path in self._resident:
+            self._resident.move_to_end(path)
+            return self._resident[path][:2]
+
+        if path not in self._loading:
+            self._loading[path] = asyncio.ensure_future(self._load(kind, path))
+        try:
+            return await asyncio.shield(self._loading[path])
+        finally:
+            self._loading.pop(path, None)
+
+    async def _load(self, kind, path):
+        loop = asyncio.get_event_loop()
+        clf, loaded, warmed = await loop.run_in_executor(
+            None, self.analyzer.read_clf, kind, path)
+        print('{} -- Loaded {} classifier {} (load {:.3f}s, warm-up '
+              '{:.3f}s)'.format(datetime.now(), kind, path, loaded, warmed))
+        return self._add(path, clf)
+
+    def _add(self, path, clf):
+        key = (path, os.path.getmtime(path))
+        self._resident.pop(path, None)
+        self._resident[path] = (clf, key, os.path.getsize(path))
+        self._evict()
+        return clf, key
+
+    def _evict(self):
+        total = sum(size for _, _, size in self._resident.values())
+        while total > self.max_bytes and len(self._resident) > 1:
+            path, (_, _, size) = self._resident.popitem(last=False)
+            total -= size
+            print('{} -- Evicted classifier {}'.format(datetime.now(), path))
+
+    async def install(self, kind, sport, clf_file, name):
+        sport_dir = os.path.join(self.dirs[kind], str(sport))
+        os.makedirs(sport_dir, exist_ok=True)
+        loop = asyncio.get_event_loop()
+        start = time.perf_counter()
+        clf, loaded, warmed = await loop.run_in_executor(
+            None, self.analyzer.read_clf, kind, clf_file)
+        path = os.path.join(sport_dir, os.path.basename(name))
+        os.replace(clf_file, path)
+        # A replaced version must not be served from the old pickle
+        self._resident.pop(path, None)
+        self.scan()
+        versions = self.versions[(kind, str(sport))]
+        versions.move_to_end(os.path.basename(path)[:-len('.pkl')])
+        self._add(path, clf)
+        return {
+            'load': loaded,
+            'warm_up': warmed,
+            'total': time.perf_counter() - start
+        }
+
+    def get_stats(self):
+        return {
+            'max_bytes': self.max_bytes,
+            'bytes': sum(size for _, _, size in self._resident.values()),
+            'resident': [key[0] for _, key, _ in self._resident.values()]
+        }